@@ -0,0 +1,39 @@
+var TrailCanvasModule = function(canvas_width, canvas_height, grid_width, grid_height) {
+	// Create the element
+	// ------------------
+
+	var canvas_tag = `<canvas width="${canvas_width}" height="${canvas_height}" class="world-grid"/>`;
+	var parent_div_tag = '<div style="height:' + canvas_height + 'px;" class="world-grid-parent"></div>';
+
+	var canvas = $(canvas_tag)[0];
+	var parent = $(parent_div_tag)[0];
+	$("#elements").append(parent);
+	parent.append(canvas);
+
+	var context = canvas.getContext("2d");
+	var cellWidth = canvas_width / grid_width;
+	var cellHeight = canvas_height / grid_height;
+
+	// colour is 0xRRGGBB, 0 is bare trail; y grows upwards, as in mesa's CanvasGrid
+	var fillCell = function(x, y, color) {
+		context.fillStyle = "#" + color.toString(16).padStart(6, "0");
+		context.fillRect(x * cellWidth, (grid_height - y - 1) * cellHeight, cellWidth, cellHeight);
+	};
+
+	// The trail comes only with key frames, which repaint everything, other frames change just some cells
+	this.render = function(data) {
+		var i;
+		if (data.trail !== undefined) {
+			context.clearRect(0, 0, canvas_width, canvas_height);
+			for (i = 0; i < data.trail.length; i++)
+				fillCell(data.trail[i][0], data.trail[i][1], 0);
+		}
+		for (i = 0; i < data.cells.length; i++)
+			fillCell(data.cells[i][0], data.cells[i][1], data.cells[i][2]);
+	};
+
+	this.reset = function() {
+		context.clearRect(0, 0, canvas_width, canvas_height);
+	};
+
+};
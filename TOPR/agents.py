@@ -1,9 +1,21 @@
+import hashlib
+from collections import defaultdict
+
 from mesa import Agent
 
+import TOPR.graph
+from TOPR.definition import load_cached, load_trail, store_cached
+from TOPR.graph import NODE_PARTS, CompiledTrail, TrailGraph
+
 
 class Tourist(Agent):
     """Represents a single Tourist cell in the simulation."""
 
+    # mesa's Agent has no __slots__, so every tourist still has a __dict__ with unique_id, model and pos -
+    # the slots keep only the fields of Tourist out of it, about 216 instead of 352 bytes per tourist
+    __slots__ = ("moore", "_pos", "_position_in_trail", "_prob_forward", "_prob_backward", "_prob_stay",
+                 "_probability", "_direction")
+
     def __init__(self, unique_id, model, position, moore=True, add_to_schedule=True,
                  probability=1.0, direction="forward", position_in_trail=0, prob_forward=0.9,
                  prob_backward=0.05, prob_stay=0.05):
@@ -35,143 +47,33 @@ class Tourist(Agent):
         """
         Step one cell in any allowable direction with concrete probability distribution.
         0.9 - forward, 0.05 - return, 0.05 - stay in place
+        Allowable moves come from the trail graph - see TrailGraph.
         """
-        contents = self.model.grid.get_cell_list_contents(self._pos)
-        is_it_node = False
-        trail = None
-        for content in contents:
-            if type(content) is TrailElement:
-                is_it_node = content.get_if_part_of_node()
-                if is_it_node:
-                    trail = content
-
-        if is_it_node is False:
-            neighbors = self.model.grid.get_neighbors(self.get_position(), moore=True, include_center=False)
-            if self._direction is "forward":
-                for neighbor in neighbors:
-
-                    # if forward tourist can go forward with forward probability
-                    if type(neighbor) is TrailElement and neighbor.get_trail_gradient() > self._position_in_trail \
-                            and neighbor.get_if_part_of_node() is False:
-                        Tourist(unique_id=self.unique_id, model=self.model, position=neighbor.unique_id,
-                                position_in_trail=self._position_in_trail + 1, direction="forward",
-                                probability=self._probability * self._prob_forward, add_to_schedule=False)
-
-                    # if forward tourist can turn over and go backward with backward probability
-                    elif type(neighbor) is TrailElement and neighbor.get_trail_gradient() < self._position_in_trail \
-                            and neighbor.get_if_part_of_node() is False:
-                        Tourist(unique_id=self.unique_id, model=self.model, position=neighbor.unique_id,
-                                position_in_trail=self._position_in_trail - 1, direction="backward",
-                                probability=self._probability * self._prob_backward, add_to_schedule=False)
-
-                    elif type(neighbor) is TrailElement and neighbor.get_trail_gradient() > self._position_in_trail \
-                            and neighbor.get_if_part_of_node() is True:
-                        Tourist(unique_id=self.unique_id, model=self.model, position=neighbor.unique_id,
-                                position_in_trail=self._position_in_trail + 1, direction="forward",
-                                probability=self._probability * self._prob_forward / 3, add_to_schedule=False)
-
-            elif self._direction is "backward":
-
-                # if backward tourist can turn over again, so go forward with backward probability
-                for neighbor in neighbors:
-                    if type(neighbor) is TrailElement and neighbor.get_trail_gradient() > self._position_in_trail \
-                            and neighbor.get_if_part_of_node() is False:
-                        Tourist(unique_id=self.unique_id, model=self.model, position=neighbor.unique_id,
-                                position_in_trail=self._position_in_trail + 1, direction="forward",
-                                probability=self._probability * self._prob_backward, add_to_schedule=False)
-
-                    # if backward tourist can go backward, but with forward probability (its forward is backward now)
-                    elif type(neighbor) is TrailElement and neighbor.get_trail_gradient() < self._position_in_trail \
-                            and neighbor.get_if_part_of_node() is False:
-                        Tourist(unique_id=self.unique_id, model=self.model, position=neighbor.unique_id,
-                                position_in_trail=self._position_in_trail - 1, direction="backward",
-                                probability=self._probability * self._prob_forward, add_to_schedule=False)
-
-                    elif type(neighbor) is TrailElement and neighbor.get_trail_gradient() < self._position_in_trail \
-                            and neighbor.get_if_part_of_node() is True:
-                        Tourist(unique_id=self.unique_id, model=self.model, position=neighbor.unique_id,
-                                position_in_trail=self._position_in_trail - 1, direction="backward",
-                                probability=self._probability * self._prob_forward / 3, add_to_schedule=False)
-
-            elif self._direction is "stay":
-                for neighbor in neighbors:
-
-                    # if tourist stayed he can go forward again
-                    if type(neighbor) is TrailElement and neighbor.get_trail_gradient() > self._position_in_trail \
-                            and neighbor.get_if_part_of_node() is False:
-                        Tourist(unique_id=self.unique_id, model=self.model, position=neighbor.unique_id,
-                                position_in_trail=self._position_in_trail + 1, direction="forward",
-                                probability=self._probability * self._prob_forward, add_to_schedule=False)
-
-                    # if tourist stayed he can go backward again
-                    elif type(neighbor) is TrailElement and neighbor.get_trail_gradient() < self._position_in_trail \
-                            and neighbor.get_if_part_of_node() is False:
-                        Tourist(unique_id=self.unique_id, model=self.model, position=neighbor.unique_id,
-                                position_in_trail=self._position_in_trail - 1, direction="backward",
-                                probability=self._probability * self._prob_backward, add_to_schedule=False)
-
-        # What happens when tourist is in the node - depending on which part of node and which direction is he going.
-        else:
-            direction = trail.get_which_dir_node()
-
-            if direction == 'left' and self._direction == 'forward':
-                x, y = trail.unique_id
-                Tourist(unique_id=self.unique_id, model=self.model, position=(x - 1, y - 1),
-                        position_in_trail=self._position_in_trail + 1, direction="forward",
-                        probability=self._probability * self._prob_forward, add_to_schedule=False)
-                Tourist(unique_id=self.unique_id, model=self.model, position=(x + 1, y + 1),
-                        position_in_trail=self._position_in_trail - 1, direction="backward",
-                        probability=self._probability * self._prob_backward, add_to_schedule=False)
-
-            elif direction == 'right' and self._direction == 'forward':
-                x, y = trail.unique_id
-                Tourist(unique_id=self.unique_id, model=self.model, position=(x + 1, y - 1),
-                        position_in_trail=self._position_in_trail + 1, direction="forward",
-                        probability=self._probability * self._prob_forward, add_to_schedule=False)
-                Tourist(unique_id=self.unique_id, model=self.model, position=(x - 1, y + 1),
-                        position_in_trail=self._position_in_trail - 1, direction="backward",
-                        probability=self._probability * self._prob_backward, add_to_schedule=False)
-
-            elif direction == 'middle' and self._direction == 'forward':
-                x, y = trail.unique_id
-                Tourist(unique_id=self.unique_id, model=self.model, position=(x, y - 1),
-                        position_in_trail=self._position_in_trail + 1, direction="forward",
-                        probability=self._probability * self._prob_forward, add_to_schedule=False)
-                Tourist(unique_id=self.unique_id, model=self.model, position=(x, y + 1),
-                        position_in_trail=self._position_in_trail - 1, direction="backward",
-                        probability=self._probability * self._prob_backward, add_to_schedule=False)
-
-            elif direction == 'left' and self._direction == 'backward':
-                x, y = trail.unique_id
-                Tourist(unique_id=self.unique_id, model=self.model, position=(x - 1, y - 1),
-                        position_in_trail=self._position_in_trail + 1, direction="forward",
-                        probability=self._probability * self._prob_backward, add_to_schedule=False)
-                Tourist(unique_id=self.unique_id, model=self.model, position=(x + 1, y + 1),
-                        position_in_trail=self._position_in_trail - 1, direction="backward",
-                        probability=self._probability * self._prob_forward, add_to_schedule=False)
-
-            elif direction == 'right' and self._direction == 'backward':
-                x, y = trail.unique_id
-                Tourist(unique_id=self.unique_id, model=self.model, position=(x + 1, y - 1),
-                        position_in_trail=self._position_in_trail + 1, direction="forward",
-                        probability=self._probability * self._prob_backward, add_to_schedule=False)
-                Tourist(unique_id=self.unique_id, model=self.model, position=(x - 1, y + 1),
-                        position_in_trail=self._position_in_trail - 1, direction="backward",
-                        probability=self._probability * self._prob_forward, add_to_schedule=False)
-
-            elif direction == 'middle' and self._direction == 'backward':
-                x, y = trail.unique_id
-                Tourist(unique_id=self.unique_id, model=self.model, position=(x, y - 1),
-                        position_in_trail=self._position_in_trail + 1, direction="forward",
-                        probability=self._probability * self._prob_backward, add_to_schedule=False)
-                Tourist(unique_id=self.unique_id, model=self.model, position=(x, y + 1),
-                        position_in_trail=self._position_in_trail - 1, direction="backward",
-                        probability=self._probability * self._prob_forward, add_to_schedule=False)
+        for move in self.model.trail.graph.get_moves(self._pos, self._direction):
+            probability = self._prob_forward if move.probability == "forward" else self._prob_backward
+            position_in_trail = self._position_in_trail + 1 if move.direction == "forward" \
+                else self._position_in_trail - 1
+            self.model.tourist_pool.add(move.target.unique_id, move.direction, self._probability * probability
+                                        / move.split, position_in_trail, self._prob_forward, self._prob_backward,
+                                        self._prob_stay)
 
         # tourist in the place we start - we assume it's the agents that stays,
         # so we give him probability of self.prob*stay_prob
         self._probability *= self._prob_stay
         self._direction = 'stay'
+        self.model.tourist_pool.settle(self)
+
+    def reset(self, position, probability, direction, position_in_trail, prob_forward, prob_backward, prob_stay):
+        """
+        Reuse the tourist as a new one - see TouristPool.
+        """
+        self._pos = position
+        self._probability = probability
+        self._direction = direction
+        self._position_in_trail = position_in_trail
+        self._prob_forward = prob_forward
+        self._prob_backward = prob_backward
+        self._prob_stay = prob_stay
 
     def get_position_in_trail(self):
         return self._position_in_trail
@@ -194,6 +96,9 @@ class Tourist(Agent):
         else:
             self._probability *= probability
 
+    def add_probability(self, probability):
+        self._probability += probability
+
     def get_prob_forward(self):
         return self._prob_forward
 
@@ -207,6 +112,75 @@ class Tourist(Agent):
         return self._direction
 
 
+class TouristPool:
+    """
+    Tourists of the next step keyed by (cell, direction). Probability coming into a cell is added to
+    the tourist already going there in the same direction instead of creating another one, and
+    tourists merged away are kept for reuse instead of being thrown away.
+
+    created, reused, merged: Number of tourists created, taken back from reuse and merged into
+    another one since the pool was made - see StepProfiler.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self._slots = {}
+        self._free = []
+        self.created = 0
+        self.reused = 0
+        self.merged = 0
+
+    def new_step(self):
+        self._slots = {}
+
+    def add(self, position, direction, probability, position_in_trail, prob_forward, prob_backward, prob_stay):
+        """
+        Add probability of tourist moving to position with direction - return tourist that carries it.
+        """
+        tourist = self._slots.get((position, direction))
+        if tourist is not None:
+            tourist.add_probability(probability)
+            self.merged += 1
+            return tourist
+
+        if self._free:
+            tourist = self._free.pop()
+            self.reused += 1
+            tourist.reset(position, probability, direction, position_in_trail, prob_forward, prob_backward,
+                          prob_stay)
+            self.model.grid.place_agent(tourist, position)
+        else:
+            tourist = Tourist(unique_id=self.model.next_id(), model=self.model, position=position,
+                              position_in_trail=position_in_trail, direction=direction, probability=probability,
+                              add_to_schedule=False, prob_forward=prob_forward, prob_backward=prob_backward,
+                              prob_stay=prob_stay)
+            self.created += 1
+        self._slots[(position, direction)] = tourist
+        return tourist
+
+    def settle(self, tourist):
+        """
+        Register tourist that has just stayed in place - if another one already stayed in the same cell,
+        his probability is added there and tourist goes off the grid to be reused.
+        """
+        key = (tourist.get_position(), tourist.get_direction())
+        existing = self._slots.get(key)
+        if existing is None:
+            self._slots[key] = tourist
+            return
+
+        existing.add_probability(tourist.get_probability())
+        self.merged += 1
+        self.release(tourist)
+
+    def release(self, tourist):
+        """
+        Take tourist off the grid and keep him for reuse.
+        """
+        self.model.grid._remove_agent(tourist.get_position(), tourist)
+        self._free.append(tourist)
+
+
 class TrailElement(Agent):
     """Represents a single Trail cell in the simulation."""
 
@@ -225,58 +199,35 @@ class TrailElement(Agent):
         self.model.grid.place_agent(self, unique_id)
 
     def advance(self):
-        contents = self.model.grid.get_cell_list_contents(self.unique_id)
-
-        tourists_stayed = []
-        tourists_forward = []
-        tourists_backward = []
-        tourist_dictionary = {"tourist_stayed": tourists_stayed, "tourists_forward": tourists_forward,
-                              "tourists_backward": tourists_backward}
-
-        # separate tourists inside of cell in reference to direction
-        for content in contents:
-            if type(content) is TrailElement:
-                pass
+        """
+        Schedule tourists inside of cell for the next step. There is only one tourist for every direction -
+        tourists going in the same direction were merged while they came in, see TouristPool.
+        Tourists with probability below model.prune_threshold are dropped and their probability
+        is added to model.pruned_probability. model.maximum_probability and model.minimum_probability
+        are of the probability of the whole cell, as with the engines.
+        """
+        x, y = self.unique_id
+        pruned = []
+        cell_probability = 0.0
+        for content in self.model.grid[x][y]:
             if type(content) is Tourist:
-                if content.get_direction() == 'stay':
-                    tourists_stayed.append(content)
-                elif content.get_direction() == 'forward':
-                    tourists_forward.append(content)
-                elif content.get_direction() == 'backward':
-                    tourists_backward.append(content)
-
-        # create resultant probability of tourists that are going in the same direction after every tourist checked -
-        # delete it from the grid - will be replaced by one tourist with resultant_probability
-        for key, values in tourist_dictionary.items():
-            if len(values) > 1:
-                resultant_probability = 0
-                unique_id = None
-                tourist_direction = None
-                position_in_trail = None
-                position = []
-                flag = 0
-                for tourist in values:
-                    if flag == 0:
-                        tourist_direction = tourist.get_direction()
-                        unique_id = tourist.unique_id
-                        position = tourist.get_position()
-                        position_in_trail = tourist.get_position_in_trail()
-                        flag += 1
-                    resultant_probability += tourist.get_probability()
-                    self.model.grid._remove_agent(position, tourist)
-
-                if resultant_probability > self.model.maximum_probability:
-                    self.model.maximum_probability = resultant_probability
-
-                if resultant_probability < self.model.minimum_probability:
-                    self.model.minimum_probability = resultant_probability
-
-                Tourist(unique_id=unique_id, model=self.model, position=position,
-                        position_in_trail=position_in_trail, direction=tourist_direction,
-                        probability=resultant_probability, add_to_schedule=True)
-            else:
-                for value in values:
-                    self.model.schedule_tourists.add(value)
+                probability = content.get_probability()
+                if probability < self.model.prune_threshold:
+                    pruned.append(content)
+                    continue
+                cell_probability += probability
+                self.model.schedule_tourists.add(content)
+
+        if cell_probability > 0:
+            if cell_probability > self.model.maximum_probability:
+                self.model.maximum_probability = cell_probability
+
+            if cell_probability < self.model.minimum_probability:
+                self.model.minimum_probability = cell_probability
+
+        for tourist in pruned:
+            self.model.pruned_probability += tourist.get_probability()
+            self.model.tourist_pool.release(tourist)
 
     def get_geo_pos(self):
         return self.unique_id
@@ -360,16 +311,70 @@ class TrailNode:
                     x += 1
 
 
+TRAIL_LAYOUTS = ("trail_for_two", "trail_for_three", "test_trail")
+
+# CompiledTrail of every layout built or loaded by this process
+_compiled_layouts = {}
+
+
+def _layout_key(layout):
+    """
+    Cache key of the named layout - it holds the hash of the code building and compiling it,
+    so changing the code builds the layout again.
+    """
+    digest = hashlib.sha256()
+    for path in (__file__, TOPR.graph.__file__):
+        with open(path, "rb") as file:
+            digest.update(file.read())
+    return "%s-%s" % (layout, digest.hexdigest()[:16])
+
+
 class Trail:
-    """Represents whole Trail in the simulation - for easier manipulation"""
+    """
+    Represents whole Trail in the simulation - for easier manipulation
 
-    def __init__(self, model):
+    agents: Whether the trail elements and start tourists were created with the trail.
+    """
+
+    def __init__(self, model, layout="trail_for_three", agents=True):
+        """
+        layout: Name of the method building the trail, one of TRAIL_LAYOUTS,
+                path of a .json trail definition (see TOPR.definition)
+                or CompiledTrail to rebuild the trail from.
+        agents: False to create the trail elements only when they are first used and no start tourists,
+                for engines keeping the probability themselves. Named layouts are then loaded from their
+                compiled form cached by the first build.
+        """
+        if isinstance(layout, str) and layout.endswith(".json"):
+            layout = load_trail(layout)
+        if not isinstance(layout, CompiledTrail) and layout not in TRAIL_LAYOUTS:
+            raise ValueError("Unknown trail layout: %s" % layout)
         self.model = model
         self._start_position = []
         self.trail = []
-        # self.trail_for_two()
-        self.trail_for_three()
-        # self.test_trail()
+        self._gradients = defaultdict(list)
+        name = None
+        if not agents and not isinstance(layout, CompiledTrail):
+            name = layout
+            if name not in _compiled_layouts:
+                _compiled_layouts[name] = load_cached(_layout_key(name))
+            if _compiled_layouts[name] is not None:
+                layout = _compiled_layouts[name]
+        self.agents = agents or not isinstance(layout, CompiledTrail)
+
+        if not self.agents:
+            self.graph = TrailGraph(None, compiled=layout, build=self._build_elements)
+            return
+        compiled = None
+        if isinstance(layout, CompiledTrail):
+            compiled = layout
+            self.from_compiled(compiled)
+        else:
+            getattr(self, layout)()
+        self.graph = TrailGraph(self.trail, self._start_position, compiled)
+        if name is not None:
+            _compiled_layouts[name] = self.graph.compile()
+            store_cached(_layout_key(name), _compiled_layouts[name])
 
     def trail_for_two(self):
         x = [20, 60]
@@ -377,9 +382,11 @@ class Trail:
         for i in range(0, 2):
             trail_element = TrailElement(unique_id=(x[i], y), model=self.model, trail_gradient=0)
             self.set_trail_start(trail_element)
-            self.trail.append(trail_element)
+            self.add_element(trail_element)
             self.model.schedule_trail_elements.add(trail_element)
-            start_tourist = Tourist(position=(x[i], y), unique_id=i, model=self.model)
+            start_tourist = Tourist(position=(x[i], y), unique_id=self.model.next_id(), model=self.model,
+                                    prob_forward=self.model.prob_forward, prob_backward=self.model.prob_backward,
+                                    prob_stay=self.model.prob_stay)
             self.model.grid.place_agent(start_tourist, (x[i], y))
 
         trail_indicator = []
@@ -389,7 +396,7 @@ class Trail:
             for j in range(1, 20):
                 trail_element = TrailElement(unique_id=(x, y - j), model=self.model, trail_gradient=j)
                 if trail_element is not None:
-                    self.trail.append(trail_element)
+                    self.add_element(trail_element)
             if trail_element is not None:
                 trail_indicator.append(trail_element)
 
@@ -400,14 +407,14 @@ class Trail:
         trail_node1.extend_node(0, 0, 20)
 
         for element in trail_node1.elements:
-            self.trail.append(element)
+            self.add_element(element)
 
         grad = trail_node1.node_right.get_trail_gradient()
         x, y = trail_node1.node_right.get_geo_pos()
         for j in range(1, 20):
             trail_element = TrailElement(unique_id=(x, y - j), model=self.model, trail_gradient=grad + j)
             if trail_element is not None:
-                self.trail.append(trail_element)
+                self.add_element(trail_element)
 
         trail_node2 = TrailNode(unique_id=trail_indicator[1].get_geo_pos(), model=self.model,
                                 contiguous_element=trail_indicator[1], right=False, middle=False)
@@ -415,7 +422,7 @@ class Trail:
         trail_node2.extend_node(20, 0, 0)
 
         for element in trail_node2.elements:
-            self.trail.append(element)
+            self.add_element(element)
 
     def trail_for_three(self):
         x = [50, 90, 130]
@@ -423,9 +430,11 @@ class Trail:
         for i in range(0, 3):
             trail_element = TrailElement(unique_id=(x[i], y), model=self.model, trail_gradient=0)
             self.set_trail_start(trail_element)
-            self.trail.append(trail_element)
+            self.add_element(trail_element)
             self.model.schedule_trail_elements.add(trail_element)
-            start_tourist = Tourist(position=(x[i], y), unique_id=i, model=self.model)
+            start_tourist = Tourist(position=(x[i], y), unique_id=self.model.next_id(), model=self.model,
+                                    prob_forward=self.model.prob_forward, prob_backward=self.model.prob_backward,
+                                    prob_stay=self.model.prob_stay)
             self.model.grid.place_agent(start_tourist, (x[i], y))
 
         trail_indicator = []
@@ -435,7 +444,7 @@ class Trail:
             for j in range(1, 20):
                 trail_element = TrailElement(unique_id=(x, y - j), model=self.model, trail_gradient=j)
                 if trail_element is not None:
-                    self.trail.append(trail_element)
+                    self.add_element(trail_element)
             if trail_element is not None:
                 trail_indicator.append(trail_element)
 
@@ -446,7 +455,7 @@ class Trail:
         trail_node1.extend_node(0, 88, 20)
 
         for element in trail_node1.elements:
-            self.trail.append(element)
+            self.add_element(element)
 
         grad = trail_node1.node_right.get_trail_gradient()
         x, y = trail_node1.node_right.get_geo_pos()
@@ -454,7 +463,7 @@ class Trail:
         for j in range(1, 50):
             trail_element = TrailElement(unique_id=(x, y - j), model=self.model, trail_gradient=grad + j)
             if trail_element is not None:
-                self.trail.append(trail_element)
+                self.add_element(trail_element)
                 trail_remember = trail_element
 
         trail_node123a = TrailNode(unique_id=trail_remember.get_geo_pos(), model=self.model,
@@ -463,21 +472,21 @@ class Trail:
         trail_node123a.extend_node(30, 0, 30)
 
         for element in trail_node123a.elements:
-            self.trail.append(element)
+            self.add_element(element)
 
         grad = trail_node123a.node_right.get_trail_gradient()
         x, y = trail_node123a.node_right.get_geo_pos()
         for j in range(1, 50):
             trail_element = TrailElement(unique_id=(x, y - j), model=self.model, trail_gradient=grad + j)
             if trail_element is not None:
-                self.trail.append(trail_element)
+                self.add_element(trail_element)
 
         grad = trail_node123a.node_left.get_trail_gradient()
         x, y = trail_node123a.node_left.get_geo_pos()
         for j in range(1, 50):
             trail_element = TrailElement(unique_id=(x, y - j), model=self.model, trail_gradient=grad + j)
             if trail_element is not None:
-                self.trail.append(trail_element)
+                self.add_element(trail_element)
 
         trail_node2 = TrailNode(unique_id=trail_indicator[1].get_geo_pos(), model=self.model,
                                 contiguous_element=trail_indicator[1], right=False, middle=False)
@@ -485,7 +494,7 @@ class Trail:
         trail_node2.extend_node(20, 0, 0)
 
         for element in trail_node2.elements:
-            self.trail.append(element)
+            self.add_element(element)
 
         trail_node3 = TrailNode(unique_id=trail_indicator[2].get_geo_pos(), model=self.model,
                                 contiguous_element=trail_indicator[2], right=False, middle=True)
@@ -493,7 +502,7 @@ class Trail:
         trail_node3.extend_node(60, 40, 0)
 
         for element in trail_node3.elements:
-            self.trail.append(element)
+            self.add_element(element)
 
         trail_node3a = TrailNode(unique_id=trail_node3.node_middle.get_geo_pos(), model=self.model,
                                  contiguous_element=trail_node3.node_middle, right=True, middle=False, left=True)
@@ -501,7 +510,7 @@ class Trail:
         trail_node3a.extend_node(20, 0, 20)
 
         for element in trail_node3a.elements:
-            self.trail.append(element)
+            self.add_element(element)
 
         trail_node3a1 = TrailNode(unique_id=trail_node3a.node_left.get_geo_pos(), model=self.model,
                                   contiguous_element=trail_node3a.node_left, left=False, middle=False, right=True)
@@ -509,7 +518,7 @@ class Trail:
         trail_node3a1.extend_node(0, 0, 20)
 
         for element in trail_node3a1.elements:
-            self.trail.append(element)
+            self.add_element(element)
 
         trail_node3a2 = TrailNode(unique_id=trail_node3a.node_right.get_geo_pos(), model=self.model,
                                   contiguous_element=trail_node3a.node_right, left=True, middle=False, right=False)
@@ -517,7 +526,7 @@ class Trail:
         trail_node3a2.extend_node(20, 0, 0)
 
         for element in trail_node3a2.elements:
-            self.trail.append(element)
+            self.add_element(element)
 
         grad = trail_node3a1.node_right.get_trail_gradient()
         x, y = trail_node3a1.node_right.get_geo_pos()
@@ -525,7 +534,7 @@ class Trail:
         for j in range(1, 20):
             trail_element = TrailElement(unique_id=(x, y - j), model=self.model, trail_gradient=grad + j)
             if trail_element is not None:
-                self.trail.append(trail_element)
+                self.add_element(trail_element)
                 trail_remember = trail_element
 
         trail_node3end = TrailNode(unique_id=trail_remember.get_geo_pos(), model=self.model,
@@ -534,7 +543,7 @@ class Trail:
         trail_node3end.extend_node(30, 50, 0)
 
         for element in trail_node3end.elements:
-            self.trail.append(element)
+            self.add_element(element)
 
     def test_trail(self):
         x = 60
@@ -542,9 +551,11 @@ class Trail:
 
         trail_element = TrailElement(unique_id=(x, y), model=self.model, trail_gradient=0)
         self.set_trail_start(trail_element)
-        self.trail.append(trail_element)
+        self.add_element(trail_element)
         self.model.schedule_trail_elements.add(trail_element)
-        start_tourist = Tourist(position=(x, y), unique_id=1, model=self.model)
+        start_tourist = Tourist(position=(x, y), unique_id=self.model.next_id(), model=self.model,
+                                prob_forward=self.model.prob_forward, prob_backward=self.model.prob_backward,
+                                prob_stay=self.model.prob_stay)
         self.model.grid.place_agent(start_tourist, (x, y))
 
         trail_indicator = []
@@ -554,7 +565,7 @@ class Trail:
             for j in range(1, 20):
                 trail_element = TrailElement(unique_id=(x, y - j), model=self.model, trail_gradient=j)
                 if trail_element is not None:
-                    self.trail.append(trail_element)
+                    self.add_element(trail_element)
             if trail_element is not None:
                 trail_indicator.append(trail_element)
 
@@ -565,17 +576,58 @@ class Trail:
         trail_node1.extend_node(5, 5, 5)
 
         for element in trail_node1.elements:
-            self.trail.append(element)
+            self.add_element(element)
+
+    def from_compiled(self, compiled):
+        """
+        Rebuild the trail from CompiledTrail, element by element in the compiled order, without
+        running the layout that created it.
+        """
+        self._add_compiled(compiled)
+        for i in compiled.starts:
+            trail_element = self.trail[i]
+            Tourist(position=trail_element.get_geo_pos(), unique_id=self.model.next_id(), model=self.model,
+                    prob_forward=self.model.prob_forward, prob_backward=self.model.prob_backward,
+                    prob_stay=self.model.prob_stay)
+
+    def _add_compiled(self, compiled):
+        """
+        Create and schedule trail elements of CompiledTrail, without any tourists.
+        """
+        for (x, y), gradient, part_of_node, which_dir_node in zip(compiled.positions, compiled.gradients,
+                                                                  compiled.part_of_node, compiled.which_dir_node):
+            trail_element = TrailElement(unique_id=(int(x), int(y)), model=self.model, trail_gradient=int(gradient),
+                                         part_of_node=bool(part_of_node),
+                                         which_dir_node=NODE_PARTS[which_dir_node] if part_of_node else None)
+            self.add_element(trail_element)
+
+        for i in compiled.starts:
+            trail_element = self.trail[i]
+            self.set_trail_start(trail_element)
+            self.model.schedule_trail_elements.add(trail_element)
+
+    def _build_elements(self):
+        self._add_compiled(self.graph.compile())
+        return self.trail
+
+    def add_element(self, element):
+        self.trail.append(element)
+        self._gradients[element.get_trail_gradient()].append(element)
+
+    def get_elements_with_gradient(self, gradient):
+        self.graph.ensure_elements()
+        return self._gradients.get(gradient, [])
 
     def add_node_to_trail(self, node):
         if node.node_left is not None:
-            self.trail.append(node.node_left)
+            self.add_element(node.node_left)
         if node.node_right is not None:
-            self.trail.append(node.node_right)
+            self.add_element(node.node_right)
         if node.node_middle is not None:
-            self.trail.append(node.node_middle)
+            self.add_element(node.node_middle)
 
     def get_trail_start(self):
+        self.graph.ensure_elements()
         return self._start_position
 
     def set_trail_start(self, start):
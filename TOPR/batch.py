@@ -0,0 +1,115 @@
+import argparse
+import os
+
+import numpy as np
+
+from TOPR.agents import TRAIL_LAYOUTS
+from TOPR.config import height, width, trail_layout, prob_forward, prob_backward, prob_stay, prune_threshold, \
+    workers, precision, convergence_tolerance
+from TOPR.convergence import METRICS, ConvergenceMonitor
+from TOPR.engine import PRECISIONS
+from TOPR.model import ENGINES, TOPRAction
+from TOPR.recorder import ProbabilityRecorder
+
+
+def run(steps, output, record=None, tolerance=None, metric="l1", relative=False, **model_params):
+    """
+    Run TOPRAction for a number of steps without any visualization and save the results of every step.
+
+    steps: How many times the model is stepped at most.
+    output: Path of the .npz file results are written to.
+    record: Directory to stream probability of every direction to with ProbabilityRecorder, not recorded if None.
+            The probability of every trail element is then kept in record/cells.npy through np.memmap
+            and written to output from there, not held in memory for the whole run.
+    tolerance: Stop once the model is converged - its metric (see ConvergenceMonitor) is at most tolerance.
+               None runs all the steps.
+    relative: Compare metric divided by the mass on the trail with tolerance.
+    model_params: Keyword arguments passed to TOPRAction.
+
+    Saved arrays - positions of trail elements, step, probability of every trail element in every step
+    (steps x trail elements), maximum_probability, minimum_probability, total_probability
+    and pruned_probability of every step done. With tolerance also l1, linf and mass_change of every step
+    and converged_step, -1 if the model did not converge.
+    """
+    model = TOPRAction(**model_params)
+    compiled = model.trail.graph.compile()
+    recorder = None
+    if record is not None:
+        recorder = ProbabilityRecorder(record, model, steps)
+    monitor = None
+    if tolerance is not None:
+        monitor = ConvergenceMonitor(model, tolerance, metric, relative)
+
+    if recorder is None:
+        probability = np.zeros((steps, len(compiled)))
+    else:
+        probability = np.lib.format.open_memmap(os.path.join(record, "cells.npy"), mode="w+", dtype=np.float64,
+                                                shape=(steps, len(compiled)))
+    maximum_probability = np.zeros(steps)
+    minimum_probability = np.zeros(steps)
+    pruned_probability = np.zeros(steps)
+    done = 0
+    while done < steps and model.running:
+        model.step()
+        # the monitor has just summed them up
+        probability[done] = model.get_cell_probabilities() if monitor is None else monitor.cells
+        maximum_probability[done] = model.maximum_probability
+        minimum_probability[done] = model.minimum_probability
+        pruned_probability[done] = model.pruned_probability
+        done += 1
+    if recorder is not None:
+        recorder.close()
+
+    results = {}
+    if monitor is not None:
+        monitor.close()
+        series = monitor.get_series()
+        results.update(l1=series["l1"], linf=series["linf"], mass_change=series["mass_change"],
+                       converged_step=-1 if monitor.converged_step is None else monitor.converged_step)
+    np.savez(output, positions=np.asarray(compiled.positions),
+             step=np.arange(1, done + 1), probability=probability[:done],
+             maximum_probability=maximum_probability[:done], minimum_probability=minimum_probability[:done],
+             total_probability=probability[:done].sum(axis=1), pruned_probability=pruned_probability[:done],
+             **results)
+    if recorder is not None:
+        probability.flush()
+    return model
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run TOPRAction headless and save results of every step.")
+    parser.add_argument("output", help="path of the .npz file with results")
+    parser.add_argument("--steps", type=int, default=100)
+    parser.add_argument("--layout", default=trail_layout,
+                        help="one of %s or path of a .json trail definition" % ", ".join(TRAIL_LAYOUTS))
+    parser.add_argument("--height", type=int, default=height)
+    parser.add_argument("--width", type=int, default=width)
+    parser.add_argument("--engine", choices=ENGINES, default="vectorized")
+    parser.add_argument("--workers", type=int, default=workers, help="processes of the partitioned engine")
+    parser.add_argument("--prob-forward", type=float, default=prob_forward)
+    parser.add_argument("--prob-backward", type=float, default=prob_backward)
+    parser.add_argument("--prob-stay", type=float, default=prob_stay)
+    parser.add_argument("--prune-threshold", type=float, default=prune_threshold,
+                        help="drop tourists with probability below it, 0 keeps all of them")
+    parser.add_argument("--precision", choices=PRECISIONS, default=precision,
+                        help="how the vectorized engine keeps probability")
+    parser.add_argument("--tolerance", type=float, nargs="?", const=convergence_tolerance,
+                        help="stop once the change of a step is at most this, %g if given without a value"
+                             % convergence_tolerance)
+    parser.add_argument("--metric", choices=METRICS, default="l1", help="change compared to the tolerance")
+    parser.add_argument("--relative", action="store_true", help="compare the change divided by the mass")
+    parser.add_argument("--record", help="directory to stream probability of every direction and step to")
+    args = parser.parse_args(argv)
+    if args.precision != "float64" and args.engine != "vectorized":
+        parser.error("--precision %s needs --engine vectorized, not %s" % (args.precision, args.engine))
+
+    model = run(args.steps, args.output, args.record, args.tolerance, args.metric, args.relative,
+                h=args.height, w=args.width, engine=args.engine,
+                layout=args.layout, prob_forward=args.prob_forward, prob_backward=args.prob_backward,
+                prob_stay=args.prob_stay, prune_threshold=args.prune_threshold, workers=args.workers,
+                precision=args.precision)
+    model.close()
+
+
+if __name__ == "__main__":
+    main()
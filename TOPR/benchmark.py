@@ -0,0 +1,243 @@
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import mesa
+import numpy as np
+
+from TOPR.agents import TRAIL_LAYOUTS
+from TOPR.definition import compile_definition
+from TOPR.generator import generate_trail
+from TOPR.model import ENGINES, TOPRAction
+
+# synthetic trails are made of blocks - a straight start SYNTHETIC_START cells long ending in a node
+# with all three parts SYNTHETIC_PART cells long
+SYNTHETIC_START = 40
+SYNTHETIC_PART = 5
+SYNTHETIC_SIZES = (10 ** 3, 10 ** 4, 10 ** 5)
+
+# program of a startup run - import, build and the first step of the model in a fresh interpreter
+STARTUP_PROGRAM = """
+import json, sys, time
+start = time.perf_counter()
+from TOPR.model import TOPRAction
+imported = time.perf_counter()
+model = TOPRAction(engine=sys.argv[2], layout=sys.argv[1])
+built = time.perf_counter()
+model.step()
+stepped = time.perf_counter()
+model.close()
+print(json.dumps({"import_seconds": imported - start, "build_seconds": built - imported,
+                  "first_step_seconds": stepped - built, "first_step_total_seconds": stepped - start,
+                  "visualization_imported": any(name.startswith("mesa.visualization") for name in sys.modules)}))
+"""
+
+
+def synthetic_definition(elements):
+    """
+    Return (definition, height, width) of a trail with about the given number of elements
+    - blocks of a straight start and a node, tiled on a grid as square as possible.
+    """
+    block_elements = SYNTHETIC_START + 3 * SYNTHETIC_PART
+    block_width = 2 * SYNTHETIC_PART + 2
+    block_height = SYNTHETIC_START + SYNTHETIC_PART + 1
+    blocks = max(1, math.ceil(elements / block_elements))
+    columns = max(1, math.ceil(math.sqrt(blocks * block_height / block_width)))
+    rows = math.ceil(blocks / columns)
+    height = rows * block_height
+    width = columns * block_width
+
+    part = {"length": SYNTHETIC_PART}
+    starts = [{"position": [column * block_width + SYNTHETIC_PART, height - 1 - row * block_height],
+               "length": SYNTHETIC_START, "node": {"left": part, "middle": part, "right": part}}
+              for row in range(rows) for column in range(columns)][:blocks]
+    return {"starts": starts}, height, width
+
+
+def _peak_memory():
+    """
+    Peak resident memory of this process in bytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _tourists(model):
+    return model.schedule_tourists.get_agent_count()
+
+
+def run_case(layout, engine, steps, elements=None):
+    """
+    Build TOPRAction and step it, measuring every phase.
+
+    layout: One of TRAIL_LAYOUTS, "synthetic" for a regular trail of the given number of elements
+            (see synthetic_definition) or "generated" for a random one (see generate_trail, seed 0).
+    engine: Engine of the model.
+    steps: How many steps to time.
+
+    Return dict of the results - times in seconds, memory in bytes.
+    """
+    baseline_memory = _peak_memory()
+    result = {"layout": layout, "engine": engine, "steps": steps}
+    model_params = {"engine": engine, "layout": layout}
+    if layout == "synthetic":
+        start = time.perf_counter()
+        definition, height, width = synthetic_definition(elements)
+        model_params.update(h=height, w=width, layout=compile_definition(definition))
+        result["compile_seconds"] = time.perf_counter() - start
+    elif layout == "generated":
+        start = time.perf_counter()
+        compiled, height, width = generate_trail(elements, seed=0)
+        model_params.update(h=height, w=width, layout=compiled)
+        result["compile_seconds"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    model = TOPRAction(**model_params)
+    result["build_seconds"] = time.perf_counter() - start
+    result["elements"] = len(model.trail.graph.compile())
+    result["grid_cells"] = model.height * model.width
+
+    step_seconds = np.zeros(steps)
+    tourists = np.zeros(steps, dtype=np.int64)
+    for step in range(steps):
+        start = time.perf_counter()
+        model.step()
+        step_seconds[step] = time.perf_counter() - start
+        tourists[step] = _tourists(model)
+
+    total = step_seconds.sum()
+    result.update({
+        "total_step_seconds": float(total),
+        "steps_per_second": steps / total if total > 0 else float("inf"),
+        "mean_step_seconds": float(step_seconds.mean()),
+        "median_step_seconds": float(np.median(step_seconds)),
+        "p95_step_seconds": float(np.percentile(step_seconds, 95)),
+        "max_step_seconds": float(step_seconds.max()),
+        "step_seconds": step_seconds.tolist(),
+        "max_tourists": int(tourists.max()),
+        "final_tourists": int(tourists[-1]),
+        "tourists": tourists.tolist(),
+        "scheduled_elements": model.schedule_trail_elements.get_agent_count(),
+        "baseline_memory": baseline_memory,
+        "peak_memory": _peak_memory(),
+    })
+    model.close()
+    return result
+
+
+def benchmark(layouts=TRAIL_LAYOUTS, sizes=SYNTHETIC_SIZES, engines=("agents", "vectorized"), steps=200,
+              isolate=True, generated=()):
+    """
+    Run run_case for every engine with every layout, synthetic trail of every size of sizes
+    and generated trail of every size of generated.
+
+    isolate: Run every case in a fresh process, so peak memory belongs to that case only
+             and cases do not warm up each other.
+
+    Return list of results of run_case, one per case.
+    """
+    cases = [(layout, engine, steps, None) for layout in layouts for engine in engines]
+    cases += [("synthetic", engine, steps, size) for size in sizes for engine in engines]
+    cases += [("generated", engine, steps, size) for size in generated for engine in engines]
+    results = []
+    for case in cases:
+        if isolate:
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                result = executor.submit(run_case, *case).result()
+        else:
+            result = run_case(*case)
+        results.append(result)
+        print("%-16s %-10s %8d elements  build %8.3f s  %10.1f steps/s  peak %8.1f MB  max tourists %d" % (
+            result["layout"], result["engine"], result["elements"], result["build_seconds"],
+            result["steps_per_second"], result["peak_memory"] / 2 ** 20, result["max_tourists"]), file=sys.stderr)
+    return results
+
+
+def startup(layouts=TRAIL_LAYOUTS, engines=("agents", "vectorized"), repeats=5):
+    """
+    Measure cold start of every engine with every layout - each run is a fresh interpreter importing
+    TOPR.model, building TOPRAction and taking its first step, repeated the given number of times.
+    The first run of a layout may build its cached compiled form, the later ones load it.
+
+    Return list of dicts, one per case - median times of the runs in seconds, process_seconds of the whole
+    process including the interpreter start, interpreter_seconds of an interpreter doing nothing,
+    and the runs themselves.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    def process(*args):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, *args], cwd=root, check=True, capture_output=True, text=True).stdout
+        return time.perf_counter() - start, output
+
+    interpreter_seconds = float(np.median([process("-c", "pass")[0] for _ in range(repeats)]))
+    results = []
+    for layout in layouts:
+        for engine in engines:
+            runs = []
+            for _ in range(repeats):
+                seconds, output = process("-c", STARTUP_PROGRAM, layout, engine)
+                runs.append(dict(json.loads(output), process_seconds=seconds))
+            result = {"layout": layout, "engine": engine, "interpreter_seconds": interpreter_seconds,
+                      "visualization_imported": any(run["visualization_imported"] for run in runs), "runs": runs}
+            for key in ("import_seconds", "build_seconds", "first_step_seconds", "first_step_total_seconds",
+                        "process_seconds"):
+                result[key] = float(np.median([run[key] for run in runs]))
+            results.append(result)
+            print("%-16s %-10s import %7.3f s  build %7.3f s  first step %7.3f s  process %7.3f s" % (
+                layout, engine, result["import_seconds"], result["build_seconds"], result["first_step_seconds"],
+                result["process_seconds"]), file=sys.stderr)
+    return results
+
+
+def environment():
+    """
+    Return description of the machine and versions the benchmark ran with, to tell runs apart.
+    """
+    return {
+        "time": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "mesa": mesa.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpus": multiprocessing.cpu_count(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark building and stepping TOPRAction.")
+    parser.add_argument("output", help="path of the .json file with results")
+    parser.add_argument("--steps", type=int, default=200)
+    parser.add_argument("--layouts", nargs="*", choices=TRAIL_LAYOUTS, default=list(TRAIL_LAYOUTS))
+    parser.add_argument("--sizes", nargs="*", type=int, default=list(SYNTHETIC_SIZES),
+                        help="numbers of elements of synthetic trails")
+    parser.add_argument("--generated", nargs="*", type=int, default=[],
+                        help="numbers of elements of randomly generated trails")
+    parser.add_argument("--engines", nargs="*", choices=ENGINES, default=["agents", "vectorized"])
+    parser.add_argument("--no-isolate", action="store_true", help="run all cases in this process")
+    parser.add_argument("--startup", type=int, default=0, metavar="REPEATS",
+                        help="measure cold start to the first step this many times per case, only that")
+    args = parser.parse_args(argv)
+
+    if args.startup:
+        output = {"startup": startup(args.layouts, args.engines, args.startup)}
+    else:
+        output = {"results": benchmark(args.layouts, args.sizes, args.engines, args.steps, not args.no_isolate,
+                                       args.generated)}
+    with open(args.output, "w") as file:
+        json.dump(dict(environment=environment(), **output), file, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+import hashlib
+import os
+
+import numpy as np
+
+from TOPR.config import result_cache, result_cache_size, result_cache_interval, prob_forward, prob_backward, \
+    prob_stay, prune_threshold
+from TOPR.engine import ProbabilityEngine
+
+# size of the snapshots in every cache directory this process knows of - from its last scan of the directory
+# and what it stored since, snapshots of other processes are seen at the next scan
+_sizes = {}
+
+
+def trail_hash(compiled):
+    """
+    Return sha256 hex digest of the content of CompiledTrail - the same trail gives the same hash,
+    however it was built.
+    """
+    digest = hashlib.sha256()
+    for field, array in compiled.get_arrays().items():
+        array = np.ascontiguousarray(array)
+        digest.update(("%s %s %s;" % (field, array.dtype.str, array.shape)).encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Probability of vectorized runs kept on disk - a snapshot of the (direction, trail element) probability
+    after the steps of a run, under a key of the compiled trail and the probabilities it ran with.
+
+    A run to step T starts from the latest snapshot of the same key not after T, so a repeated run
+    is a single load and a longer one takes only the steps not done before. Snapshots are files
+    path/key/step.npy, when all of them take more than max_bytes the least recently used are deleted
+    down to three quarters of it. The directory is scanned for that only once the snapshots are over max_bytes
+    by the count of this process, so the cache can outgrow max_bytes by what other processes stored meanwhile.
+    Runs start from one forward tourist in every trail start, as ProbabilityEngine does by default.
+
+    hits: Number of runs that found a snapshot of their step.
+    steps_run: Number of steps the engines of all runs took.
+    """
+
+    def __init__(self, path=result_cache, max_bytes=result_cache_size, interval=result_cache_interval):
+        """
+        path: Directory of the snapshots, shared by any number of processes.
+        max_bytes: Size of the snapshots above which the least recently used are deleted.
+        interval: Snapshot is stored after every interval steps of a run and after its last step.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.hits = 0
+        self.steps_run = 0
+
+    @staticmethod
+    def key(compiled, prob_forward, prob_backward, prob_stay, prune_threshold=0.0):
+        """
+        Return key of the runs of CompiledTrail with the given probabilities.
+        """
+        return hashlib.sha256(("%s %r %r %r %r" % (trail_hash(compiled), float(prob_forward), float(prob_backward),
+                                                   float(prob_stay), float(prune_threshold))).encode()).hexdigest()
+
+    def run(self, compiled, steps, prob_forward=prob_forward, prob_backward=prob_backward, prob_stay=prob_stay,
+            prune_threshold=prune_threshold):
+        """
+        Return ProbabilityEngine of CompiledTrail after the given number of steps with the given probabilities,
+        resumed from the latest snapshot of the run not after steps and storing snapshots of the steps it takes.
+        """
+        engine = ProbabilityEngine(compiled, None, prob_forward, prob_backward, prob_stay, prune_threshold)
+        directory = os.path.join(self.path, self.key(compiled, prob_forward, prob_backward, prob_stay,
+                                                     prune_threshold))
+        step = self._load_latest(directory, steps, engine)
+        if 0 < step == steps:
+            self.hits += 1
+        while step < steps:
+            engine.step()
+            step += 1
+            self.steps_run += 1
+            if step % self.interval == 0 or step == steps:
+                self._store(directory, step, engine)
+        return engine
+
+    def get_steps(self, compiled, prob_forward=prob_forward, prob_backward=prob_backward, prob_stay=prob_stay,
+                  prune_threshold=prune_threshold):
+        """
+        Return sorted list of steps of the run with snapshots in the cache.
+        """
+        return self._steps(os.path.join(self.path, self.key(compiled, prob_forward, prob_backward, prob_stay,
+                                                                prune_threshold)))
+
+    @staticmethod
+    def _steps(directory):
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return []
+        return sorted(int(name[:-len(".npy")]) for name in names if name.endswith(".npy"))
+
+    def _load_latest(self, directory, steps, engine):
+        """
+        Load the latest snapshot not after steps into engine, return its step - 0 if there is none.
+        """
+        for step in reversed([step for step in self._steps(directory) if step <= steps]):
+            snapshot = os.path.join(directory, "%d.npy" % step)
+            try:
+                with open(snapshot, "rb") as file:
+                    probability = np.load(file)
+                    engine.total_pruned_probability, engine.pruned_probability = np.load(file).tolist()
+                # loaded again - the most recently used
+                os.utime(snapshot)
+            except FileNotFoundError:
+                # evicted by another process in the meantime
+                continue
+            engine.probability = probability
+            engine._update_extremes()
+            return step
+        return 0
+
+    def _store(self, directory, step, engine):
+        snapshot = os.path.join(directory, "%d.npy" % step)
+        os.makedirs(directory, exist_ok=True)
+        # written under a temporary name first, so other processes never read half of the file
+        temporary = "%s.%d" % (snapshot, os.getpid())
+        with open(temporary, "wb") as file:
+            np.save(file, engine.probability)
+            np.save(file, np.array([engine.total_pruned_probability, engine.pruned_probability]))
+        os.replace(temporary, snapshot)
+        path = os.path.abspath(self.path)
+        if path not in _sizes:
+            _sizes[path] = self.get_size()
+        else:
+            _sizes[path] += os.path.getsize(snapshot)
+        if _sizes[path] > self.max_bytes:
+            # down to less than the limit, so the next snapshots do not scan the directory again right away
+            self.evict(self.max_bytes * 3 // 4)
+
+    def get_size(self):
+        """
+        Return size of all snapshots in bytes.
+        """
+        return sum(size for _, size, _ in self._snapshots())
+
+    def _snapshots(self):
+        """
+        Iterate over (last use, size, path) of all snapshots.
+        """
+        if not os.path.isdir(self.path):
+            return
+        for directory in os.scandir(self.path):
+            if not directory.is_dir():
+                continue
+            try:
+                entries = list(os.scandir(directory.path))
+            except FileNotFoundError:
+                # removed by another process in the meantime
+                continue
+            for entry in entries:
+                if not entry.name.endswith(".npy"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, stat.st_size, entry.path
+
+    def evict(self, max_bytes=None):
+        """
+        Delete the least recently used snapshots until all of them take at most max_bytes,
+        by default max_bytes of the cache.
+        """
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        snapshots = sorted(self._snapshots())
+        size = sum(size for _, size, _ in snapshots)
+        for _, snapshot_size, snapshot in snapshots:
+            if size <= max_bytes:
+                break
+            try:
+                os.remove(snapshot)
+            except FileNotFoundError:
+                pass
+            size -= snapshot_size
+            try:
+                # directory of a run without any snapshot left
+                os.rmdir(os.path.dirname(snapshot))
+            except OSError:
+                pass
+        _sizes[os.path.abspath(self.path)] = size
+
+    def clear(self):
+        """
+        Delete all snapshots.
+        """
+        self.evict(0)
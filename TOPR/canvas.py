@@ -0,0 +1,60 @@
+import numpy as np
+from mesa.visualization.ModularVisualization import VisualizationElement
+
+from TOPR.config import canvas_keyframe_interval
+from TOPR.portrayal import probability_colors
+
+
+class TrailCanvas(VisualizationElement):
+    """
+    Canvas of the trail drawn by TrailCanvas.js. A key frame carries the static trail and all coloured cells,
+    other frames only the cells whose colour changed since the previous frame.
+
+    The element is shared by all connections of the server and the previous frame may have gone to another
+    one, so a browser can miss changes - the first frame of every model and every keyframe_interval-th frame
+    after it are key frames, which repaint the whole canvas.
+
+    Frame: {"trail": [[x, y], ...] - only in key frames,
+            "cells": [[x, y, colour], ...]} where colour is 0xRRGGBB, 0 is bare trail.
+    """
+
+    local_includes = ["TOPR/TrailCanvas.js"]
+
+    def __init__(self, grid_width, grid_height, canvas_width=500, canvas_height=500,
+                 keyframe_interval=canvas_keyframe_interval):
+        """
+        grid_width, grid_height: Size of the grid, in cells.
+        canvas_height, canvas_width: Size of the canvas to draw in the client, in pixels.
+        keyframe_interval: Number of frames from one key frame to the next.
+        """
+        super().__init__()
+        self.grid_width = grid_width
+        self.grid_height = grid_height
+        self.canvas_width = canvas_width
+        self.canvas_height = canvas_height
+        self.js_code = "elements.push(new TrailCanvasModule({}, {}, {}, {}));".format(
+            self.canvas_width, self.canvas_height, self.grid_width, self.grid_height)
+        self.keyframe_interval = keyframe_interval
+        self._model = None
+        self._colors = None
+        # frames since the last key frame
+        self._frames = 0
+
+    def render(self, model):
+        positions = model.get_positions()
+        colors = probability_colors(model.get_cell_probabilities(), model.minimum_probability,
+                                    model.maximum_probability)
+
+        frame = {}
+        if model is not self._model or self._frames >= self.keyframe_interval:
+            self._model = model
+            self._frames = 0
+            frame["trail"] = positions.tolist()
+            changed = np.flatnonzero(colors)
+        else:
+            changed = np.flatnonzero(colors != self._colors)
+        self._colors = colors
+        self._frames += 1
+
+        frame["cells"] = np.column_stack((positions[changed], colors[changed])).tolist()
+        return frame
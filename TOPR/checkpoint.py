@@ -0,0 +1,103 @@
+import numpy as np
+
+from TOPR.agents import Tourist
+from TOPR.graph import DIRECTIONS, CompiledTrail
+from TOPR.model import TOPRAction
+
+CHECKPOINT_VERSION = 1
+
+
+def save_checkpoint(model, path):
+    """
+    Save the whole state of TOPRAction to path (.npz) - trail topology, probability of the tourists,
+    step_performed and contents of both schedulers.
+    """
+    compiled = model.trail.graph.compile()
+    index = model.trail.graph.index
+
+    state = {
+        "version": CHECKPOINT_VERSION,
+        "engine": model.engine_name,
+        # -1 for all cores
+        "workers": -1 if model.workers is None else model.workers,
+        "size": (model.height, model.width),
+        "probabilities": (model.prob_forward, model.prob_backward, model.prob_stay),
+        "step_performed": model.step_performed,
+        "maximum_probability": model.maximum_probability,
+        "minimum_probability": model.minimum_probability,
+        "prune_threshold": model.prune_threshold,
+        "precision": model.precision,
+        "total_pruned_probability": model.total_pruned_probability,
+        "scheduled_elements": [index[element.get_geo_pos()] for element in model.schedule_trail_elements.agents],
+    }
+
+    if model.engine is not None:
+        # as the engine keeps it, so no probability is lost converting it
+        state["probability"] = model.engine.get_state()
+    else:
+        # tourists in the order of the scheduler - placed back in it, they fill every cell in the order
+        # they were in, so the restored run sums the probability up the same way, bit for bit
+        tourists = model.schedule_tourists.agents
+        state["tourist_elements"] = np.array([index[tourist.get_position()] for tourist in tourists], dtype=np.int64)
+        state["tourist_directions"] = np.array([DIRECTIONS.index(tourist.get_direction()) for tourist in tourists],
+                                               dtype=np.int8)
+        state["tourist_probabilities"] = np.array([tourist.get_probability() for tourist in tourists], dtype=float)
+        state["tourist_positions_in_trail"] = np.array([tourist.get_position_in_trail() for tourist in tourists],
+                                                       dtype=np.int64)
+
+    state.update(("trail_" + field, array) for field, array in compiled.get_arrays().items())
+    np.savez(path, **state)
+
+
+def load_checkpoint(path):
+    """
+    Rebuild TOPRAction saved by save_checkpoint, ready to continue stepping. The trail is built from
+    the saved topology, its layout is not run again.
+    """
+    with np.load(path) as checkpoint:
+        if int(checkpoint["version"]) != CHECKPOINT_VERSION:
+            raise ValueError("Unsupported checkpoint version: %s" % checkpoint["version"])
+        compiled = CompiledTrail(**{field: checkpoint["trail_" + field] for field in CompiledTrail.fields})
+        height, width = (int(value) for value in checkpoint["size"])
+        prob_forward, prob_backward, prob_stay = (float(value) for value in checkpoint["probabilities"])
+        engine = str(checkpoint["engine"])
+        workers = int(checkpoint["workers"]) if "workers" in checkpoint else -1
+        # checkpoints saved before pruning was added have none
+        prune_threshold = float(checkpoint["prune_threshold"]) if "prune_threshold" in checkpoint else 0.0
+        precision = str(checkpoint["precision"]) if "precision" in checkpoint else "float64"
+
+        model = TOPRAction(h=height, w=width, engine=engine, layout=compiled, prob_forward=prob_forward,
+                           prob_backward=prob_backward, prob_stay=prob_stay, prune_threshold=prune_threshold,
+                           precision=precision, workers=None if workers < 0 else workers)
+        model.step_performed = int(checkpoint["step_performed"])
+        model.maximum_probability = float(checkpoint["maximum_probability"])
+        model.minimum_probability = float(checkpoint["minimum_probability"])
+        if "total_pruned_probability" in checkpoint:
+            model.total_pruned_probability = float(checkpoint["total_pruned_probability"])
+
+        if model.engine is not None:
+            model.engine.set_state(checkpoint["probability"])
+            model.engine.maximum_probability = model.maximum_probability
+            model.engine.minimum_probability = model.minimum_probability
+            model.engine.total_pruned_probability = model.total_pruned_probability
+            return model
+
+        # only tourist agents need the trail elements, the engines leave them unbuilt
+        elements = model.trail.graph.elements
+        model.schedule_trail_elements = type(model.schedule_trail_elements)(model)
+        for i in checkpoint["scheduled_elements"]:
+            model.schedule_trail_elements.add(elements[i])
+
+        # tourists the trail started with are replaced by the saved ones
+        for tourist in model.schedule_tourists.agents:
+            model.grid._remove_agent(tourist.get_position(), tourist)
+            model.schedule_tourists.remove(tourist)
+        for i, direction, probability, position_in_trail in zip(checkpoint["tourist_elements"],
+                                                                 checkpoint["tourist_directions"],
+                                                                 checkpoint["tourist_probabilities"],
+                                                                 checkpoint["tourist_positions_in_trail"]):
+            Tourist(unique_id=model.next_id(), model=model, position=elements[i].get_geo_pos(),
+                    probability=float(probability), direction=DIRECTIONS[direction],
+                    position_in_trail=int(position_in_trail), prob_forward=prob_forward,
+                    prob_backward=prob_backward, prob_stay=prob_stay)
+    return model
@@ -1,6 +1,31 @@
+import os
+
 width = 200
 height = 200
 canvas_width = 1000
 canvas_height = 1000
+# frames of TrailCanvas from one full repaint to the next
+canvas_keyframe_interval = 25
 initial_tourist = 1
 trail_length = 1000
+engine = "agents"
+trail_layout = "trail_for_three"
+prob_forward = 0.9
+prob_backward = 0.05
+prob_stay = 0.05
+# probability below which tourists are dropped, 0 keeps all of them
+prune_threshold = 0.0
+# worker processes of the partitioned engine, None for all cores
+workers = None
+# how the vectorized engine keeps probability - "float64", "float32" or "log", see ProbabilityEngine
+precision = "float64"
+# directory of compiled trails, see TOPR.definition - in the user cache, whatever the working directory is
+cache_home = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "TOPR")
+trail_cache = os.path.join(cache_home, "trails")
+# change of the probability at which a run is converged, see TOPR.convergence
+convergence_tolerance = 1e-6
+# directory and size in bytes of the snapshots of vectorized runs, see TOPR.cache - in the user cache as well
+result_cache = os.path.join(cache_home, "results")
+result_cache_size = 2 ** 30
+# steps of a run from one of its snapshots to the next, the last step is always stored
+result_cache_interval = 50
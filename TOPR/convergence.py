@@ -0,0 +1,100 @@
+import numpy as np
+
+from TOPR.config import convergence_tolerance
+
+# change of the distribution measured after every step
+METRICS = ("l1", "linf", "mass_change")
+# columns of ConvergenceMonitor.get_series
+COLUMNS = ("step", "l1", "linf", "mass", "mass_change")
+
+
+class ConvergenceMonitor:
+    """
+    Measures how much the probability of the trail elements changes in every step of TOPRAction
+    and stops the model once it settles.
+
+    After every step: l1 and linf - L1 and L-infinity norm of the change of probability of every trail element,
+    mass - total probability on the trail and mass_change - its change, absolute. Only the elements holding
+    any probability before or after the step are compared, those nothing reached are skipped.
+    The model is converged after the first step whose metric is at most tolerance - the monitor sets
+    model.running to False, so Model.run_model and the batch run stop there, and keeps the step
+    in converged_step (None until then).
+
+    Where moves of a node add up to more than 1 the mass keeps growing and never settles, while its shape
+    does - relative compares the change of the distribution scaled to mass 1 (l1, linf) or the change
+    of mass divided by the mass (mass_change) with the tolerance then.
+
+    Only the elements occupied before or after a step are read and compared - see TOPRAction.get_occupied_cells,
+    with tourist agents the cost of a step follows the number of tourists, not the length of the trail.
+
+    cells: Probability of every trail element after the last step.
+    """
+
+    def __init__(self, model, tolerance=convergence_tolerance, metric="l1", relative=False):
+        """
+        model: TOPRAction to monitor, the monitor attaches itself to it.
+        tolerance: Change of metric at which the model is converged.
+        metric: One of METRICS.
+        relative: Compare metric of the distribution scaled to mass 1 with tolerance, not metric itself.
+        """
+        if metric not in METRICS:
+            raise ValueError("Unknown metric: %s" % metric)
+        self.model = model
+        self.tolerance = tolerance
+        self.metric = metric
+        self.relative = relative
+        self.converged_step = None
+        self.l1 = self.linf = self.mass_change = None
+        self.cells = model.get_cell_probabilities()
+        self.mass = float(self.cells.sum())
+        # elements holding probability after the last step
+        self._occupied = np.flatnonzero(self.cells)
+        self._rows = []
+        model.monitor = self
+
+    def update(self, model):
+        """
+        Measure the step model has just done - called by TOPRAction.step.
+        """
+        occupied, probabilities = model.get_occupied_cells()
+        touched = np.union1d(self._occupied, occupied)
+        before = self.cells[touched]
+        after = np.zeros(touched.size)
+        after[np.searchsorted(touched, occupied)] = probabilities
+        mass = float(probabilities.sum())
+        change = np.abs(after - before)
+        self.l1 = float(change.sum())
+        self.linf = float(change.max(initial=0.0))
+        self.mass_change = abs(mass - self.mass)
+        step = model.step_performed - 1
+        self._rows.append((step, self.l1, self.linf, mass, self.mass_change))
+
+        change = getattr(self, self.metric)
+        if self.relative:
+            if self.metric == "mass_change":
+                change = change / mass if mass > 0 else 0.0
+            else:
+                shape = np.abs(after / max(mass, np.finfo(float).tiny) - before / max(self.mass, np.finfo(float).tiny))
+                change = shape.sum() if self.metric == "l1" else shape.max(initial=0.0)
+        self.cells[touched] = after
+        self._occupied = occupied
+        self.mass = mass
+        if self.converged_step is None and change <= self.tolerance:
+            self.converged_step = step
+            model.running = False
+
+    def get_series(self):
+        """
+        Return {column: array with value of every monitored step} for COLUMNS.
+        """
+        rows = np.array(self._rows, dtype=float).reshape(-1, len(COLUMNS))
+        series = {column: rows[:, i] for i, column in enumerate(COLUMNS)}
+        series["step"] = series["step"].astype(np.int64)
+        return series
+
+    def close(self):
+        """
+        Detach from the model - it is not monitored any more.
+        """
+        if self.model.monitor is self:
+            self.model.monitor = None
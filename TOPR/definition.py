@@ -0,0 +1,184 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+import TOPR.graph
+from TOPR.config import trail_cache
+from TOPR.graph import NODE_PARTS, CompiledTrail, compile_trail
+
+# direction every piece of the trail grows in - straight pieces go up, node parts go along their side
+PIECE_STEPS = {"straight": (0, -1), "left": (-1, -1), "middle": (0, -1), "right": (1, -1)}
+
+
+class TrailBuilder:
+    """
+    Builds a trail element by element straight into arrays, without agents - with the rules of TrailNode:
+    a piece of trail grows cell by cell with gradient one higher every cell and ends where it runs into
+    a cell that is already part of the trail.
+    """
+
+    def __init__(self):
+        self.positions = []
+        self.gradients = []
+        self.which_dir_node = []
+        self.starts = []
+        self.index = {}
+
+    def __len__(self):
+        return len(self.positions)
+
+    def add(self, position, gradient, part=-1):
+        """
+        Add element at position, part is index of NODE_PARTS for the first cell of a node part.
+        Return its index, None if the cell is already taken.
+        """
+        if position in self.index:
+            return None
+        self.index[position] = len(self.positions)
+        self.positions.append(position)
+        self.gradients.append(gradient)
+        self.which_dir_node.append(part)
+        return self.index[position]
+
+    def add_start(self, position):
+        """
+        Add trail start at position, return its index.
+        """
+        start = self.add(tuple(position), 0)
+        if start is None:
+            raise ValueError("Trail start %s is already part of the trail" % (position,))
+        self.starts.append(start)
+        return start
+
+    def grow(self, length, last, kind):
+        """
+        Add up to length cells of the given kind ("straight" or one of NODE_PARTS) after element last,
+        return index of the last one added - None if there was no room for any.
+        """
+        dx, dy = PIECE_STEPS[kind]
+        part = NODE_PARTS.index(kind) if kind in NODE_PARTS else -1
+        end = None
+        for i in range(length):
+            x, y = self.positions[last]
+            added = self.add((x + dx, y + dy), self.gradients[last] + 1, part if i == 0 else -1)
+            if added is None:
+                break
+            last = end = added
+        return end
+
+    def compile(self, shift=(0, 0)):
+        """
+        Return the trail built so far as CompiledTrail, with positions moved by shift.
+        """
+        which_dir_node = np.array(self.which_dir_node, dtype=np.int8)
+        positions = np.array(self.positions, dtype=np.int64).reshape(-1, 2) + shift
+        return compile_trail(positions=positions, gradients=self.gradients, part_of_node=which_dir_node >= 0,
+                             which_dir_node=which_dir_node, starts=self.starts)
+
+
+def compile_definition(definition):
+    """
+    Compile a declarative trail definition into CompiledTrail without creating any agents.
+
+    Definition: {"starts": [start, ...]}
+    start: {"position": [x, y], "length": n, "straight": piece, "node": node} - n cells going up
+           from position, position included.
+    piece: {"length": n, "straight": piece, "node": node} - n cells continuing the trail from
+           the last cell of the piece it belongs to.
+    node: {"left": piece, "middle": piece, "right": piece} - branches starting at the last cell of
+          the piece, their first cells are parts of the node (see TrailNode).
+    "straight", "node" and every part of a node are optional. Gradient grows by one with every cell,
+    a piece ends where it runs into a cell that is already part of the trail (like TrailNode.extend_node).
+    """
+    builder = TrailBuilder()
+
+    def follow(piece, last):
+        """
+        Add what continues from element last - the last cell of piece.
+        """
+        for name in NODE_PARTS:
+            if name in piece.get("node", {}):
+                end = builder.grow(piece["node"][name]["length"], last, name)
+                if end is not None:
+                    follow(piece["node"][name], end)
+        if "straight" in piece:
+            end = builder.grow(piece["straight"]["length"], last, "straight")
+            if end is not None:
+                follow(piece["straight"], end)
+
+    for start in definition["starts"]:
+        first = builder.add_start(start["position"])
+        end = builder.grow(start["length"] - 1, first, "straight")
+        follow(start, first if end is None else end)
+    return builder.compile()
+
+
+def load_cached(key, cache_dir=trail_cache):
+    """
+    Return CompiledTrail stored in cache_dir under key by store_cached, None if there is none.
+    """
+    cached = os.path.join(cache_dir, key + ".trail")
+    if not os.path.exists(cached):
+        return None
+    with open(cached, "rb") as file:
+        return CompiledTrail(**{field: np.load(file) for field in CompiledTrail.fields})
+
+
+def store_cached(key, compiled, cache_dir=trail_cache):
+    """
+    Store CompiledTrail in cache_dir under key - its arrays saved one after another in the order
+    of CompiledTrail.fields, plain .npy without a zip around them, so loading them is quick.
+
+    The cache only saves time - if cache_dir cannot be written the trail is not stored and False is returned.
+    """
+    cached = os.path.join(cache_dir, key + ".trail")
+    # written under a temporary name first, so other processes never read half of the file
+    temporary = "%s.%d" % (cached, os.getpid())
+    arrays = compiled.get_arrays()
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(temporary, "wb") as file:
+            for field in CompiledTrail.fields:
+                np.save(file, arrays[field])
+        os.replace(temporary, cached)
+    except OSError:
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+        return False
+    return True
+
+
+def _definition_key(definition):
+    """
+    Cache key of a trail definition - it holds the hash of the code compiling it as well,
+    so changing the code compiles the definition again.
+    """
+    digest = hashlib.sha256(json.dumps(definition, sort_keys=True).encode())
+    for path in (__file__, TOPR.graph.__file__):
+        with open(path, "rb") as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+def load_trail(path, cache_dir=trail_cache):
+    """
+    Load trail definition from JSON file at path and return it as CompiledTrail.
+
+    Compiled trail is cached in cache_dir under the hash of the definition and of the code compiling it,
+    so the same definition is compiled only once. cache_dir None turns the cache off.
+    """
+    with open(path) as file:
+        definition = json.load(file)
+    if cache_dir is None:
+        return compile_definition(definition)
+
+    key = _definition_key(definition)
+    compiled = load_cached(key, cache_dir)
+    if compiled is None:
+        compiled = compile_definition(definition)
+        store_cached(key, compiled, cache_dir)
+    return compiled
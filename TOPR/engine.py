@@ -0,0 +1,410 @@
+import numpy as np
+
+from TOPR.graph import DIRECTIONS, FORWARD, BACKWARD, STAY
+
+# how ProbabilityEngine keeps the probability - see its docstring
+PRECISIONS = ("float64", "float32", "log")
+
+
+def build_transitions(compiled, prob_forward, prob_backward, prob_stay):
+    """
+    Build the transition matrix of a CompiledTrail in coordinate form - (rows, cols, weights),
+    where rows and cols are flat indexes of (direction, trail element).
+    """
+    size = len(compiled)
+    probabilities = np.zeros(len(DIRECTIONS))
+    probabilities[FORWARD] = prob_forward
+    probabilities[BACKWARD] = prob_backward
+
+    # every tourist leaves a part of himself in place, whatever direction he had
+    elements = np.tile(np.arange(size), len(DIRECTIONS))
+    directions = np.repeat(np.arange(len(DIRECTIONS)), size)
+
+    target_directions = compiled.target_directions.astype(np.intp)
+    source_directions = compiled.source_directions.astype(np.intp)
+    rows = np.concatenate((target_directions * size + compiled.targets, STAY * size + elements))
+    cols = np.concatenate((source_directions * size + compiled.sources, directions * size + elements))
+    weights = np.concatenate((probabilities[compiled.probabilities] / compiled.splits,
+                              np.full(elements.size, float(prob_stay))))
+    return rows.astype(np.intp), cols.astype(np.intp), weights
+
+
+class ProbabilityEngine:
+    """
+    Propagates the probability of tourists over the trail without Tourist agents.
+
+    State is kept as a (direction, trail element) array and every step is one sparse
+    matrix-vector product built from the moves of the compiled trail graph.
+
+    precision is how the state is kept, one of PRECISIONS:
+    "float64" - probability as it is.
+    "float32" - probability in half of the memory, every step is summed in float64 and rounded back.
+                Results differ from float64 by up to 5e-6 relative after 100 steps and 5e-5 after 1000,
+                probability below about 1e-45 becomes 0.
+    "log" - natural logarithm of probability, moves are summed with log-sum-exp. Probability never
+            underflows, however long the run is, and agrees with float64 to 1e-12 relative
+            where float64 does not underflow. Steps are about five times slower.
+    Whatever the precision, probability, get_cell_probabilities and the others return float64 probability -
+    the state is converted only there.
+    """
+
+    def __init__(self, compiled, probability=None, prob_forward=0.9, prob_backward=0.05, prob_stay=0.05,
+                 prune_threshold=0.0, precision="float64"):
+        """
+        compiled: CompiledTrail whose elements index the probability arrays.
+        probability: Initial (direction, trail element) array, by default one forward
+                     tourist in every trail start.
+        prune_threshold: Probability below which a (direction, trail element) is set to 0 after every step,
+                         the dropped probability is kept in pruned_probability and total_pruned_probability.
+        precision: How the probability is kept, one of PRECISIONS.
+        """
+        if precision not in PRECISIONS:
+            raise ValueError("Unknown precision: %s" % precision)
+        self.precision = precision
+        self.compiled = compiled
+        self.index = compiled.index
+        if probability is None:
+            probability = np.zeros((len(DIRECTIONS), len(compiled)))
+            probability[FORWARD, compiled.starts] = 1.0
+        self.probability = probability
+        self.prob_forward = prob_forward
+        self.prob_backward = prob_backward
+        self.prob_stay = prob_stay
+        self.prune_threshold = prune_threshold
+        self.pruned_probability = 0.0
+        self.total_pruned_probability = 0.0
+        self.maximum_probability = 0
+        self.minimum_probability = 1
+        self._rows, self._cols, self._weights = build_transitions(compiled, prob_forward, prob_backward, prob_stay)
+        if precision == "float32":
+            self._weights = self._weights.astype(np.float32)
+        elif precision == "log":
+            # moves sorted by the state they go to, moves into _targets[i] start at _starts[i]
+            order = np.argsort(self._rows, kind="stable")
+            self._targets, self._starts, self._counts = np.unique(self._rows[order], return_index=True,
+                                                                  return_counts=True)
+            self._cols = self._cols[order]
+            with np.errstate(divide="ignore"):
+                self._weights = np.log(self._weights[order])
+
+    @property
+    def probability(self):
+        """
+        (direction, trail element) array of probability, float64 whatever the precision.
+        """
+        return self._to_probability(self._probability)
+
+    @probability.setter
+    def probability(self, probability):
+        probability = np.asarray(probability, dtype=np.float64)
+        if self.precision == "float32":
+            probability = probability.astype(np.float32)
+        elif self.precision == "log":
+            with np.errstate(divide="ignore"):
+                probability = np.log(probability)
+        self._probability = probability
+
+    def _to_probability(self, state):
+        if self.precision == "log":
+            return np.exp(state)
+        return state.astype(np.float64, copy=False)
+
+    def get_state(self):
+        """
+        Return the state as it is kept - probability, or its logarithm with the log precision.
+        """
+        return self._probability
+
+    def set_state(self, state):
+        """
+        Replace the state by one of get_state of an engine with the same precision.
+        """
+        self._probability = np.array(state, dtype=np.float32 if self.precision == "float32" else np.float64)
+
+    @classmethod
+    def from_model(cls, model, prune_threshold=0.0, **kwargs):
+        """
+        Create the engine for the trail of model and move the probability of the tourists
+        placed by the trail into it - the agents are taken off the grid, from now on
+        the engine is the only owner of the state.
+        kwargs: Other arguments of the engine class.
+        """
+        compiled = model.trail.graph.compile()
+        if not model.trail.agents:
+            # trail without start tourists - the engine starts from the trail starts
+            return cls(compiled, None, model.prob_forward, model.prob_backward, model.prob_stay, prune_threshold,
+                       **kwargs)
+        probability = np.zeros((len(DIRECTIONS), len(compiled)))
+        for tourist in model.schedule_tourists.agents:
+            position = tourist.get_position()
+            probability[DIRECTIONS.index(tourist.get_direction()), compiled.index[position]] += \
+                tourist.get_probability()
+            model.grid._remove_agent(position, tourist)
+            model.schedule_tourists.remove(tourist)
+        return cls(compiled, probability, model.prob_forward, model.prob_backward, model.prob_stay, prune_threshold,
+                   **kwargs)
+
+    def step(self):
+        """
+        Advance the probability of all tourists by one step.
+        """
+        if self.precision == "log":
+            self._step_log()
+            return
+        state = self._probability.ravel()
+        state = np.bincount(self._rows, weights=self._weights * state[self._cols], minlength=state.size)
+        self.pruned_probability = 0.0
+        if self.prune_threshold > 0:
+            pruned = (state > 0) & (state < self.prune_threshold)
+            self.pruned_probability = float(state[pruned].sum())
+            self.total_pruned_probability += self.pruned_probability
+            state[pruned] = 0.0
+        self._probability = state.reshape(self._probability.shape).astype(self._probability.dtype, copy=False)
+        self._update_extremes()
+
+    def _step_log(self):
+        """
+        step with the log precision - every state is the log-sum-exp of the moves into it.
+        """
+        state = self._probability.ravel()
+        terms = self._weights + state[self._cols]
+        peaks = np.maximum.reduceat(terms, self._starts)
+        # states no probability moves into stay at log 0
+        reached = np.isfinite(peaks)
+        peaks = np.where(reached, peaks, 0.0)
+        sums = np.add.reduceat(np.exp(terms - np.repeat(peaks, self._counts)), self._starts)
+        state = np.full(state.size, -np.inf)
+        with np.errstate(divide="ignore"):
+            state[self._targets] = np.where(reached, peaks + np.log(sums), -np.inf)
+        self.pruned_probability = 0.0
+        if self.prune_threshold > 0:
+            pruned = np.isfinite(state) & (state < np.log(self.prune_threshold))
+            self.pruned_probability = float(np.exp(state[pruned]).sum())
+            self.total_pruned_probability += self.pruned_probability
+            state[pruned] = -np.inf
+        self._probability = state.reshape(self._probability.shape)
+        self._update_extremes()
+
+    def _update_extremes(self):
+        """
+        Set maximum_probability and minimum_probability to those of the occupied trail elements.
+        """
+        totals = self.get_cell_probabilities()
+        occupied = totals[totals > 0]
+        if occupied.size:
+            self.maximum_probability = occupied.max()
+            self.minimum_probability = occupied.min()
+
+    def get_cell_probabilities(self):
+        """
+        Return probability of every trail element, summed over directions, in the order of the compiled trail.
+        """
+        return self._to_probability(self._probability).sum(axis=0)
+
+    def get_probability(self, position, direction=None):
+        """
+        Return probability of tourists in the trail element at position.
+        direction: One of DIRECTIONS, or None for all of them together.
+        """
+        i = self.index.get(position)
+        if i is None:
+            return 0.0
+        probability = self._to_probability(self._probability[:, i])
+        if direction is None:
+            return float(probability.sum())
+        return float(probability[DIRECTIONS.index(direction)])
+
+    def get_total_probability(self):
+        return float(self.probability.sum())
+
+    def close(self):
+        """
+        Release what the engine holds besides memory - nothing here, see PartitionedEngine.
+        """
+
+
+class MultiSourceEngine:
+    """
+    Propagates tourists from several sources at once, keeping the probability of every source apart.
+
+    State is a (direction, trail element, source) array - one column of ProbabilityEngine state per source,
+    all of them advanced together in every step. Tourists of one source usually reach only a small part
+    of the trail, so only the nonzero (state, source) pairs are kept and moved - a step costs about as much
+    as the moves of the states holding any probability, not as many runs as there are sources.
+    """
+
+    def __init__(self, compiled, sources=None, prob_forward=0.9, prob_backward=0.05, prob_stay=0.05):
+        """
+        compiled: CompiledTrail whose elements index the probability arrays.
+        sources: (x, y) positions of trail elements with one forward tourist each, by default the trail starts.
+        """
+        self.compiled = compiled
+        self.index = compiled.index
+        if sources is None:
+            sources = [tuple(int(value) for value in compiled.positions[start]) for start in compiled.starts]
+        self.sources = [tuple(source) for source in sources]
+        for source in self.sources:
+            if source not in self.index:
+                raise ValueError("Source %s is not on the trail" % (source,))
+        self.shape = (len(DIRECTIONS), len(compiled), len(self.sources))
+        self.prob_forward = prob_forward
+        self.prob_backward = prob_backward
+        self.prob_stay = prob_stay
+
+        # nonzero pairs - flat (direction, trail element) state, source and probability
+        self._states = np.array([FORWARD * len(compiled) + self.index[source] for source in self.sources],
+                                dtype=np.intp)
+        self._columns = np.arange(len(self.sources), dtype=np.intp)
+        self._values = np.ones(len(self.sources))
+
+        rows, cols, weights = build_transitions(compiled, prob_forward, prob_backward, prob_stay)
+        # moves sorted by the state they leave, moves of state i are _rows[_first[i]:_first[i + 1]]
+        order = np.argsort(cols, kind="stable")
+        self._rows = rows[order]
+        self._weights = weights[order]
+        self._first = np.searchsorted(cols[order], np.arange(len(DIRECTIONS) * len(compiled) + 1))
+
+    @classmethod
+    def from_model(cls, model, sources=None):
+        """
+        Create the engine for the trail of model, by default with a source in every trail start.
+        """
+        if sources is None:
+            sources = [element.get_geo_pos() for element in model.trail.get_trail_start()]
+        return cls(model.trail.graph.compile(), sources, model.prob_forward, model.prob_backward, model.prob_stay)
+
+    def step(self):
+        """
+        Advance the probability of tourists of all sources by one step.
+        """
+        first = self._first[self._states]
+        counts = self._first[self._states + 1] - first
+        pairs = np.repeat(np.arange(self._states.size), counts)
+        moves = np.arange(pairs.size) - np.repeat(np.cumsum(counts) - counts, counts) + first[pairs]
+
+        keys = self._rows[moves] * len(self.sources) + self._columns[pairs]
+        keys, inverse = np.unique(keys, return_inverse=True)
+        values = np.bincount(inverse, weights=self._weights[moves] * self._values[pairs], minlength=keys.size)
+
+        nonzero = values != 0
+        keys = keys[nonzero]
+        self._states = keys // len(self.sources)
+        self._columns = keys % len(self.sources)
+        self._values = values[nonzero]
+
+    @property
+    def probability(self):
+        """
+        (direction, trail element, source) array of probability.
+        """
+        probability = np.zeros(self.shape)
+        probability.reshape(-1, len(self.sources))[self._states, self._columns] = self._values
+        return probability
+
+    def get_cell_probabilities(self):
+        """
+        Return (trail element, source) array of probability, summed over directions - the origin-destination
+        breakdown, elements in the order of the compiled trail and sources in the order of sources.
+        """
+        probability = np.zeros(self.shape[1:])
+        np.add.at(probability, (self._states % self.shape[1], self._columns), self._values)
+        return probability
+
+    def get_source_probabilities(self, source):
+        """
+        Return (direction, trail element) probability of tourists that started at the source position.
+        """
+        column = self._columns == self.sources.index(tuple(source))
+        probability = np.zeros(self.shape[:2])
+        probability.ravel()[self._states[column]] = self._values[column]
+        return probability
+
+    def get_total_probabilities(self):
+        """
+        Return total probability of tourists of every source.
+        """
+        return np.bincount(self._columns, weights=self._values, minlength=len(self.sources))
+
+
+class AdjointEngine:
+    """
+    Propagates the importance of a target trail element backwards over the trail - the moves of ProbabilityEngine
+    reversed, with the same forward / backward / stay weights and splits of nodes.
+
+    Importance starts as 1 in every direction of the target. After T steps importance of a (direction,
+    trail element) state is the probability a tourist starting in that state is in the target T steps later,
+    so one backward run gives the contribution of every possible origin to the target at once - a run costs
+    as much as one run of ProbabilityEngine, whatever the number of origins.
+    """
+
+    def __init__(self, compiled, target, prob_forward=0.9, prob_backward=0.05, prob_stay=0.05, direction=None):
+        """
+        compiled: CompiledTrail whose elements index the importance arrays.
+        target: (x, y) position of the trail element whose probability is attributed.
+        direction: One of DIRECTIONS to attribute probability of tourists with it only, None for all of them.
+        """
+        self.compiled = compiled
+        self.index = compiled.index
+        self.target = tuple(target)
+        if self.target not in self.index:
+            raise ValueError("Target %s is not on the trail" % (self.target,))
+        self.prob_forward = prob_forward
+        self.prob_backward = prob_backward
+        self.prob_stay = prob_stay
+        self.steps = 0
+
+        self.importance = np.zeros((len(DIRECTIONS), len(compiled)))
+        if direction is None:
+            self.importance[:, self.index[self.target]] = 1.0
+        else:
+            self.importance[DIRECTIONS.index(direction), self.index[self.target]] = 1.0
+        self._rows, self._cols, self._weights = build_transitions(compiled, prob_forward, prob_backward, prob_stay)
+
+    @classmethod
+    def from_model(cls, model, target, direction=None):
+        """
+        Create the engine for the trail of model, with its probabilities.
+        """
+        return cls(model.trail.graph.compile(), target, model.prob_forward, model.prob_backward, model.prob_stay,
+                   direction)
+
+    def step(self):
+        """
+        Move the importance one step back in time.
+        """
+        state = self.importance.ravel()
+        state = np.bincount(self._cols, weights=self._weights * state[self._rows], minlength=state.size)
+        self.importance = state.reshape(self.importance.shape)
+        self.steps += 1
+
+    def run(self, steps):
+        """
+        Step the engine the given number of times.
+        """
+        for _ in range(steps):
+            self.step()
+
+    def get_contributions(self, probability=None):
+        """
+        Return (direction, trail element) array of probability that the given probability of every state
+        puts into the target after steps - the sum of it is the probability of the target.
+        probability: (direction, trail element) array of probability steps before, by default one forward
+                     tourist in every trail start.
+        """
+        if probability is None:
+            probability = np.zeros(self.importance.shape)
+            probability[FORWARD, self.compiled.starts] = 1.0
+        return self.importance * probability
+
+    def get_source_contributions(self, sources=None):
+        """
+        Return probability that one forward tourist starting at every source puts into the target after steps.
+        sources: (x, y) positions of trail elements, by default the trail starts.
+        """
+        if sources is None:
+            elements = np.asarray(self.compiled.starts, dtype=np.intp)
+        else:
+            elements = np.array([self.index.get(tuple(source), -1) for source in sources], dtype=np.intp)
+            if (elements < 0).any():
+                raise ValueError("Source %s is not on the trail" % (tuple(sources[int(np.argmin(elements))]),))
+        return self.importance[FORWARD, elements]
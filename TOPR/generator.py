@@ -0,0 +1,78 @@
+from collections import deque
+
+import numpy as np
+
+from TOPR.definition import TrailBuilder
+from TOPR.graph import NODE_PARTS
+
+
+def generate_trail(cells, branch_factor=2, segment_length=20, seed=None, spread=3):
+    """
+    Generate a random branching trail of the given number of cells, without creating any agents.
+
+    The trail grows from a trail start like the hand written layouts - a straight segment ends in a node with
+    branch_factor of its left / middle / right parts, every part goes spread cells along its side and then
+    a straight segment on, which ends in the next node. Segments are segment_length cells long on average.
+    Pieces running into the trail end there (see TrailBuilder); when no branch can go on, another trail start
+    is added next to the trail, so the trail always gets all the cells.
+
+    cells: Number of trail elements.
+    branch_factor: Number of parts of every node, 1 - 3.
+    segment_length: Average length of straight segments.
+    seed: Seed of the random generator, the same arguments give the same trail.
+    spread: Number of cells node parts go aside before going straight.
+
+    Return (CompiledTrail, height, width) - positions start at (0, 0), height and width of the grid it fits in.
+    """
+    if not 1 <= branch_factor <= len(NODE_PARTS):
+        raise ValueError("Branch factor must be 1 - %d, not %s" % (len(NODE_PARTS), branch_factor))
+    if cells < 1 or segment_length < 1 or spread < 1:
+        raise ValueError("Number of cells, segment length and spread must be positive")
+    rng = np.random.default_rng(seed)
+    builder = TrailBuilder()
+    # ends of straight segments that get a node next
+    ends = deque()
+    right_edge = -1
+
+    def segment():
+        return int(rng.integers(max(1, segment_length // 2), segment_length + segment_length // 2 + 1))
+
+    def grow(length, last, kind):
+        """
+        Grow piece from last, return its end if it got all of its length.
+        """
+        nonlocal right_edge
+        before = len(builder)
+        end = builder.grow(min(length, cells - before), last, kind)
+        if len(builder) > before:
+            right_edge = max(right_edge, max(x for x, _ in builder.positions[before:]))
+        if end is not None and builder.gradients[end] - builder.gradients[last] == length:
+            return end
+        return None
+
+    def straight(length, last):
+        end = grow(length, last, "straight")
+        if end is not None:
+            ends.append(end)
+
+    while len(builder) < cells:
+        if not ends:
+            # nothing can grow any more - new trail start beyond the right edge of the trail
+            x = right_edge + 2 * spread + 2
+            first = builder.add_start((x, 0))
+            right_edge = x
+            straight(segment(), first)
+        else:
+            last = ends.popleft()
+            parts = np.sort(rng.choice(len(NODE_PARTS), size=branch_factor, replace=False))
+            for part in parts:
+                if len(builder) >= cells:
+                    break
+                end = grow(spread, last, NODE_PARTS[part])
+                if end is not None:
+                    straight(segment(), end)
+
+    positions = np.array(builder.positions, dtype=np.int64)
+    low = positions.min(axis=0)
+    height, width = positions.max(axis=0)[::-1] - low[::-1] + 1
+    return builder.compile(shift=-low), int(height), int(width)
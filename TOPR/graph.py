@@ -0,0 +1,227 @@
+from collections import namedtuple
+
+import numpy as np
+
+DIRECTIONS = ("forward", "backward", "stay")
+FORWARD, BACKWARD, STAY = 0, 1, 2
+
+# A single way a tourist can leave a trail element:
+# target - element he lands in, direction - his direction after the move,
+# probability - which of tourist's probabilities ("forward" / "backward") the move happens with,
+# split - that probability is divided between the parts of a node he enters.
+Move = namedtuple("Move", ["target", "direction", "probability", "split"])
+
+# cells a tourist standing in a node element moves to - (forward, backward) offsets for every part of the node
+NODE_OFFSETS = {'left': ((-1, -1), (1, 1)),
+                'right': ((1, -1), (-1, 1)),
+                'middle': ((0, -1), (0, 1))}
+
+NODE_PARTS = ("left", "middle", "right")
+
+MOORE_OFFSETS = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if (dx, dy) != (0, 0)]
+
+# Moves as (source direction, target direction, probability, split) for every kind of neighbour.
+# Tourist outside of node moves to the neighbours with higher (ahead) or lower (behind) gradient:
+AHEAD = ((FORWARD, FORWARD, FORWARD, 1),
+         # backward tourist can turn over again, so go forward with backward probability
+         (BACKWARD, FORWARD, BACKWARD, 1),
+         (STAY, FORWARD, FORWARD, 1))
+BEHIND = ((FORWARD, BACKWARD, BACKWARD, 1),
+          # backward tourist goes backward with forward probability (its forward is backward now)
+          (BACKWARD, BACKWARD, FORWARD, 1),
+          (STAY, BACKWARD, BACKWARD, 1))
+# forward probability is split between the parts of a node tourist enters
+INTO_NODE_AHEAD = ((FORWARD, FORWARD, FORWARD, 3),)
+INTO_NODE_BEHIND = ((BACKWARD, BACKWARD, FORWARD, 3),)
+# in the node tourist goes along its part of the node, the one that stayed there does not move at all
+NODE_AHEAD = AHEAD[:2]
+NODE_BEHIND = BEHIND[:2]
+
+
+def _find(positions, queries):
+    """
+    Return index of every (x, y) of queries in positions, -1 where there is no such position.
+    """
+    shift = positions.min(axis=0) - 1
+    stride = positions[:, 1].max() - shift[1] + 2
+    keys = (positions[:, 0] - shift[0]) * stride + positions[:, 1] - shift[1]
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+
+    query_keys = (queries[:, 0] - shift[0]) * stride + queries[:, 1] - shift[1]
+    found = np.minimum(np.searchsorted(sorted_keys, query_keys), len(sorted_keys) - 1)
+    return np.where(sorted_keys[found] == query_keys, order[found], -1)
+
+
+def compile_trail(positions, gradients, part_of_node, which_dir_node, starts):
+    """
+    Compile trail described element by element into CompiledTrail - find moves between the elements
+    for all of them at once.
+
+    positions: (x, y) of every element.
+    gradients: Trail gradient of every element.
+    part_of_node: Whether element is the first cell of a node part.
+    which_dir_node: Index of NODE_PARTS of node elements, -1 for the others.
+    starts: Indexes of elements tourists start from.
+    """
+    positions = np.asarray(positions, dtype=np.int64).reshape(-1, 2)
+    gradients = np.asarray(gradients, dtype=np.int64)
+    part_of_node = np.asarray(part_of_node, dtype=bool)
+    which_dir_node = np.asarray(which_dir_node, dtype=np.int8)
+    moves = []
+
+    def add_moves(sources, targets, rules):
+        for source_direction, target_direction, probability, split in rules:
+            moves.append((sources, np.full(sources.size, source_direction), targets,
+                          np.full(sources.size, target_direction), np.full(sources.size, probability),
+                          np.full(sources.size, split)))
+
+    if len(positions):
+        outside = np.flatnonzero(~part_of_node)
+        for dx, dy in MOORE_OFFSETS:
+            neighbors = _find(positions, positions[outside] + (dx, dy))
+            sources = outside[neighbors >= 0]
+            targets = neighbors[neighbors >= 0]
+            ahead = gradients[targets] > gradients[sources]
+            behind = gradients[targets] < gradients[sources]
+            into_node = part_of_node[targets]
+            add_moves(sources[ahead & ~into_node], targets[ahead & ~into_node], AHEAD)
+            add_moves(sources[behind & ~into_node], targets[behind & ~into_node], BEHIND)
+            add_moves(sources[ahead & into_node], targets[ahead & into_node], INTO_NODE_AHEAD)
+            add_moves(sources[behind & into_node], targets[behind & into_node], INTO_NODE_BEHIND)
+
+        for part, name in enumerate(NODE_PARTS):
+            nodes = np.flatnonzero(part_of_node & (which_dir_node == part))
+            for offset, rules in zip(NODE_OFFSETS[name], (NODE_AHEAD, NODE_BEHIND)):
+                targets = _find(positions, positions[nodes] + offset)
+                add_moves(nodes[targets >= 0], targets[targets >= 0], rules)
+
+    columns = [np.concatenate([move[column] for move in moves]) if moves else np.zeros(0) for column in range(6)]
+    return CompiledTrail(positions=positions, gradients=gradients, part_of_node=part_of_node,
+                         which_dir_node=which_dir_node, starts=np.asarray(starts, dtype=np.int64),
+                         sources=columns[0].astype(np.int64), source_directions=columns[1].astype(np.int8),
+                         targets=columns[2].astype(np.int64), target_directions=columns[3].astype(np.int8),
+                         probabilities=columns[4].astype(np.int8), splits=columns[5].astype(np.int8))
+
+
+class TrailGraph:
+    """
+    Adjacency of the trail compiled once after the trail is built, so moving tourists
+    is a plain lookup instead of scanning the grid around them every step.
+
+    queries: Number of get_moves lookups - neighbour queries of the tourists, see StepProfiler.
+    """
+
+    def __init__(self, elements, starts=(), compiled=None, build=None):
+        """
+        elements: TrailElements of the whole trail, None to create them by build when they are first used.
+        starts: TrailElements tourists start from.
+        compiled: CompiledTrail the elements were built from, if any - it is not compiled again.
+                  Required without elements.
+        build: Function returning TrailElements of compiled in its order, for the trail without elements.
+        """
+        self._build = build
+        if elements is None:
+            self._elements = None
+            self.starts = compiled.starts.tolist()
+        else:
+            self._elements = list(elements)
+            index = {element.get_geo_pos(): i for i, element in enumerate(self._elements)}
+            self.starts = [index[element.get_geo_pos()] for element in starts]
+            if compiled is None:
+                compiled = compile_trail(
+                    positions=[element.get_geo_pos() for element in self._elements],
+                    gradients=[element.get_trail_gradient() for element in self._elements],
+                    part_of_node=[element.get_if_part_of_node() for element in self._elements],
+                    which_dir_node=[NODE_PARTS.index(element.get_which_dir_node())
+                                    if element.get_if_part_of_node() else -1 for element in self._elements],
+                    starts=self.starts)
+        self._compiled = compiled
+        self.index = compiled.index
+        self.queries = 0
+        # Moves of every element, made on the first get_moves - only tourist agents need them
+        self._moves = None
+
+    @property
+    def elements(self):
+        """
+        TrailElements of the whole trail, in the order of the compiled trail.
+        """
+        self.ensure_elements()
+        return self._elements
+
+    def ensure_elements(self):
+        """
+        Create the TrailElements of the trail built without them, nothing if they exist.
+        """
+        if self._elements is None:
+            self._elements = list(self._build())
+
+    def _build_moves(self):
+        compiled = self._compiled
+        elements = self.elements
+        moves = [{name: [] for name in DIRECTIONS} for _ in elements]
+        for source, source_direction, target, target_direction, probability, split in zip(
+                compiled.sources.tolist(), compiled.source_directions.tolist(), compiled.targets.tolist(),
+                compiled.target_directions.tolist(), compiled.probabilities.tolist(), compiled.splits.tolist()):
+            moves[source][DIRECTIONS[source_direction]].append(
+                Move(elements[target], DIRECTIONS[target_direction], DIRECTIONS[probability], split))
+        return moves
+
+    def get_moves(self, position, direction):
+        """
+        Return list of Moves of a tourist standing at position with the given direction.
+        """
+        self.queries += 1
+        i = self.index.get(position)
+        if i is None:
+            return []
+        if self._moves is None:
+            self._moves = self._build_moves()
+        return self._moves[i][direction]
+
+    def compile(self):
+        """
+        Return the graph as CompiledTrail - the same moves as flat arrays without any agents.
+        """
+        return self._compiled
+
+
+class CompiledTrail:
+    """
+    Trail graph as flat arrays - no agents or model inside, so it is cheap to pickle,
+    send to other processes and store.
+
+    Elements are described by positions, gradients, part_of_node and which_dir_node
+    (index of NODE_PARTS, -1 outside of nodes), starts are indexes of trail starts.
+    Every move i goes from element sources[i] with direction source_directions[i] to element
+    targets[i] with direction target_directions[i], with tourist's probabilities[i]
+    (FORWARD / BACKWARD) divided by splits[i]. Directions are indexes of DIRECTIONS.
+    """
+
+    fields = ("positions", "gradients", "part_of_node", "which_dir_node", "starts", "sources", "source_directions",
+              "targets", "target_directions", "probabilities", "splits")
+
+    def __init__(self, positions, gradients, part_of_node, which_dir_node, starts, sources, source_directions,
+                 targets, target_directions, probabilities, splits):
+        self.positions = positions
+        self.gradients = gradients
+        self.part_of_node = part_of_node
+        self.which_dir_node = which_dir_node
+        self.starts = starts
+        self.sources = sources
+        self.source_directions = source_directions
+        self.targets = targets
+        self.target_directions = target_directions
+        self.probabilities = probabilities
+        self.splits = splits
+        self.index = {(int(x), int(y)): i for i, (x, y) in enumerate(positions)}
+
+    def __len__(self):
+        return len(self.positions)
+
+    def get_arrays(self):
+        """
+        Return {field: array} - CompiledTrail(**arrays) builds the same trail again.
+        """
+        return {field: getattr(self, field) for field in self.fields}
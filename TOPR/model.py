@@ -1,9 +1,16 @@
+import numpy as np
 from mesa import Model
 from mesa.time import SimultaneousActivation
-from mesa.space import MultiGrid
 
-from TOPR.agents import Trail, TrailElement
-from TOPR.config import height, width
+from TOPR.agents import Trail, Tourist, TouristPool
+from TOPR.config import height, width, engine, trail_layout, prob_forward, prob_backward, prob_stay, \
+    prune_threshold, workers, precision
+from TOPR.engine import ProbabilityEngine
+from TOPR.graph import DIRECTIONS
+from TOPR.space import TrailGrid
+
+
+ENGINES = ("agents", "vectorized", "partitioned")
 
 
 class TOPRAction(Model):
@@ -11,11 +18,31 @@ class TOPRAction(Model):
     Represents the 2-dimensional array of cells
     """
 
-    def __init__(self, h=height, w=width):
+    def __init__(self, h=height, w=width, engine=engine, layout=trail_layout, prob_forward=prob_forward,
+                 prob_backward=prob_backward, prob_stay=prob_stay, prune_threshold=prune_threshold,
+                 workers=workers, precision=precision):
         """
         Create a action area of (height, width) cells.
+        engine: "agents" to move Tourist agents over the grid,
+                "vectorized" to propagate probability with ProbabilityEngine,
+                "partitioned" to propagate it with PartitionedEngine in several processes.
+        layout: Trail layout to build, one of TRAIL_LAYOUTS, path of a .json trail definition,
+                or CompiledTrail to rebuild the trail from.
+        prob_forward, prob_backward, prob_stay: Probabilities tourists move with.
+        prune_threshold: Tourists whose probability falls below it are dropped after every step,
+                         their probability is added up in pruned_probability (this step)
+                         and total_pruned_probability (whole run). 0 keeps all of them.
+        workers: Number of processes of the partitioned engine, all cores if None.
+        precision: How the vectorized engine keeps probability, one of PRECISIONS (see ProbabilityEngine).
+                   Tourist agents and the partitioned engine keep it in float64 only.
         """
+        if engine not in ENGINES:
+            raise ValueError("Unknown engine: %s" % engine)
+        if precision != "float64" and engine != "vectorized":
+            raise ValueError("Precision %s needs the vectorized engine, not %s" % (precision, engine))
         super().__init__()
+        self.engine_name = engine
+        self.workers = workers
         self.height = h
         self.width = w
         self.tourists_on_trail = 0
@@ -23,11 +50,44 @@ class TOPRAction(Model):
         self.steps_of_tourist_1 = 1
         self.schedule_tourists = SimultaneousActivation(self)
         self.schedule_trail_elements = SimultaneousActivation(self)
+        self.tourist_pool = TouristPool(self)
         self.step_performed = 1
-        self.grid = MultiGrid(self.height, self.width, torus=False)
-        self.trail = Trail(self)
+        self.prob_forward = prob_forward
+        self.prob_backward = prob_backward
+        self.prob_stay = prob_stay
+        self.prune_threshold = prune_threshold
+        self.precision = precision
+        self.pruned_probability = 0.0
+        self.total_pruned_probability = 0.0
+        self.grid = TrailGrid(self.width, self.height, torus=False)
+        # engines keep the probability themselves - trail elements are made only if something asks for them
+        self.trail = Trail(self, layout, agents=engine == "agents")
         self.maximum_probability = 0
         self.minimum_probability = 1
+        self.recorder = None
+        self.profiler = None
+        self.monitor = None
+        self.engine = None
+        if engine == "vectorized":
+            self.engine = ProbabilityEngine.from_model(self, prune_threshold, precision=precision)
+        elif engine == "partitioned":
+            # imported here, so the processes and shared memory it needs are loaded only when it is used
+            from TOPR.parallel import PartitionedEngine
+            self.engine = PartitionedEngine.from_model(self, prune_threshold, workers=workers)
+        if self.engine is not None:
+            self.phases = (("engine", self._step_engine),)
+        else:
+            self.phases = (("tourists", self._step_tourists), ("scheduler", self._new_tourist_schedule),
+                           ("trail_scan", self._schedule_trail_elements),
+                           ("trail_elements", self._step_trail_elements))
+
+    def close(self):
+        """
+        Release what the engine holds besides memory - worker processes and shared memory
+        of the partitioned engine. The model can not be stepped any more then.
+        """
+        if self.engine is not None:
+            self.engine.close()
 
     def step(self):
         """
@@ -35,11 +95,88 @@ class TOPRAction(Model):
         """
         self.maximum_probability = 0
         self.minimum_probability = 1
+        self.pruned_probability = 0.0
+        if self.profiler is None:
+            for _, phase in self.phases:
+                phase()
+        else:
+            self.profiler.profile(self)
+        self.total_pruned_probability += self.pruned_probability
+        self.step_performed += 1
+
+        if self.recorder is not None:
+            self.recorder.record(self)
+        if self.monitor is not None:
+            self.monitor.update(self)
+
+    # Phases of a step, in the order they run - see phases and StepProfiler
+    def _step_engine(self):
+        self.engine.step()
+        self.maximum_probability = self.engine.maximum_probability
+        self.minimum_probability = self.engine.minimum_probability
+        self.pruned_probability = self.engine.pruned_probability
+
+    def _step_tourists(self):
+        self.tourist_pool.new_step()
         self.schedule_tourists.step()
+
+    def _new_tourist_schedule(self):
         self.schedule_tourists = SimultaneousActivation(self)
-        for element in self.trail.trail:
-            if type(element) is TrailElement:
-                if element.get_trail_gradient() == self.step_performed:
-                    self.schedule_trail_elements.add(element)
+
+    def _schedule_trail_elements(self):
+        # every gradient is reached exactly once, so each element gets into the schedule only once
+        for element in self.trail.get_elements_with_gradient(self.step_performed):
+            self.schedule_trail_elements.add(element)
+
+    def _step_trail_elements(self):
         self.schedule_trail_elements.step()
-        self.step_performed += 1
+
+    def get_positions(self):
+        """
+        Return (x, y) of every trail element, in the order of trail.graph.elements.
+        """
+        return self.trail.graph.compile().positions
+
+    def get_probabilities(self):
+        """
+        Return (direction, trail element) array of probability, directions as in DIRECTIONS
+        and elements in the order of trail.graph.elements.
+        """
+        if self.engine is not None:
+            return self.engine.probability
+
+        probabilities = np.zeros((len(DIRECTIONS), len(self.trail.graph.elements)))
+        for i, element in enumerate(self.trail.graph.elements):
+            x, y = element.get_geo_pos()
+            for content in self.grid[x][y]:
+                if type(content) is Tourist:
+                    probabilities[DIRECTIONS.index(content.get_direction()), i] += content.get_probability()
+        return probabilities
+
+    def get_cell_probabilities(self):
+        """
+        Return probability of every trail element, summed over directions, in the order of trail.graph.elements.
+        """
+        return self.get_probabilities().sum(axis=0)
+
+    def get_occupied_cells(self):
+        """
+        Return (indexes, probabilities) of the trail elements holding any probability, indexes sorted
+        in the order of trail.graph.elements and probabilities summed over directions. Tourist agents
+        are read from the schedule, so the elements nobody is in are not visited.
+        """
+        if self.engine is not None:
+            cells = self.engine.get_cell_probabilities()
+            indexes = np.flatnonzero(cells)
+            return indexes, cells[indexes]
+
+        index = self.trail.graph.index
+        tourists = self.schedule_tourists.agents
+        positions = np.fromiter((index[tourist.get_position()] for tourist in tourists), dtype=np.intp,
+                                count=len(tourists))
+        probabilities = np.fromiter((tourist.get_probability() for tourist in tourists), dtype=np.float64,
+                                    count=len(tourists))
+        indexes, inverse = np.unique(positions, return_inverse=True)
+        cells = np.bincount(inverse, weights=probabilities, minlength=indexes.size)
+        occupied = cells != 0
+        return indexes[occupied], cells[occupied]
@@ -0,0 +1,108 @@
+import numpy as np
+
+from TOPR.config import initial_tourist
+from TOPR.engine import build_transitions
+from TOPR.graph import DIRECTIONS, FORWARD
+
+
+class MonteCarloEngine:
+    """
+    Simulates single visitors walking the trail, all of them at once as arrays instead of agents.
+
+    Every visitor is a (direction, trail element) state, each step he takes one of the moves of the compiled
+    trail with its probability (prob_forward, prob_backward or prob_stay, divided between the parts of
+    a node), or leaves the trail with what is left to 1 - e.g. walking forward at the end of the trail.
+    Where moves of a state add up to more than 1 (tourist of ProbabilityEngine goes to several neighbours
+    ahead at once) a visitor takes one of them, with their probabilities scaled to sum up to 1.
+    """
+
+    def __init__(self, compiled, visitors=initial_tourist, prob_forward=0.9, prob_backward=0.05, prob_stay=0.05,
+                 seed=None, track=0):
+        """
+        compiled: CompiledTrail visitors walk.
+        visitors: Number of visitors starting forward in every trail start.
+        seed: Seed of the random generator, the same seed gives the same run.
+        track: Number of visitors whose path is kept - see get_paths.
+        """
+        self.compiled = compiled
+        self.size = len(compiled)
+        self.prob_forward = prob_forward
+        self.prob_backward = prob_backward
+        self.prob_stay = prob_stay
+        self.rng = np.random.default_rng(seed)
+
+        # state of every visitor, -1 once he left the trail
+        self.states = np.repeat(FORWARD * self.size + np.asarray(compiled.starts, dtype=np.intp), visitors)
+        self.departed = 0
+
+        rows, cols, weights = build_transitions(compiled, prob_forward, prob_backward, prob_stay)
+        order = np.argsort(cols, kind="stable")
+        rows, cols, weights = rows[order], cols[order], weights[order]
+        totals = np.bincount(cols, weights=weights, minlength=len(DIRECTIONS) * self.size)
+        weights = weights / np.maximum(totals, 1.0)[cols]
+        # cumulative probability of the moves of every state shifted by the state, so that the move of
+        # a visitor in state s drawing u is the first one with _bounds above s + u
+        cumulative = np.cumsum(weights)
+        before = (cumulative - weights)[np.searchsorted(cols, cols)]
+        self._bounds = cols + (cumulative - before)
+        self._targets = rows
+        self._sources = cols
+
+        self.track = track
+        self._paths = [self.states[:track] % self.size]
+
+    @classmethod
+    def from_model(cls, model, visitors=initial_tourist, seed=None, track=0):
+        """
+        Create the engine for the trail of model, with its probabilities.
+        """
+        return cls(model.trail.graph.compile(), visitors, model.prob_forward, model.prob_backward, model.prob_stay,
+                   seed, track)
+
+    def step(self):
+        """
+        Move every visitor on the trail by one step.
+        """
+        walking = np.flatnonzero(self.states >= 0)
+        states = self.states[walking]
+        moves = np.searchsorted(self._bounds, states + self.rng.random(states.size), side="right")
+        # drawn past the last move of his state - visitor leaves the trail
+        stays = moves < self._sources.size
+        moves = np.minimum(moves, self._sources.size - 1)
+        stays &= self._sources[moves] == states
+        self.states[walking] = np.where(stays, self._targets[moves], -1)
+        self.departed += int(np.count_nonzero(~stays))
+
+        if self.track:
+            tracked = self.states[:self.track]
+            self._paths.append(np.where(tracked >= 0, tracked % self.size, -1))
+
+    def get_occupancy(self):
+        """
+        Return number of visitors in every trail element, in the order of the compiled trail.
+        """
+        walking = self.states[self.states >= 0]
+        return np.bincount(walking % self.size, minlength=self.size)
+
+    def get_direction_occupancy(self):
+        """
+        Return (direction, trail element) array of numbers of visitors.
+        """
+        walking = self.states[self.states >= 0]
+        return np.bincount(walking, minlength=len(DIRECTIONS) * self.size).reshape(len(DIRECTIONS), self.size)
+
+    def get_paths(self):
+        """
+        Return (step, visitor) array of trail elements the first track visitors were in, -1 after they left.
+        """
+        return np.array(self._paths).reshape(len(self._paths), self.track)
+
+    def run(self, steps):
+        """
+        Step the engine the given number of times, return (step, trail element) array of occupancy after each.
+        """
+        occupancy = np.zeros((steps, self.size), dtype=np.int64)
+        for step in range(steps):
+            self.step()
+            occupancy[step] = self.get_occupancy()
+        return occupancy
@@ -0,0 +1,234 @@
+import multiprocessing
+import weakref
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from TOPR.config import workers as default_workers
+from TOPR.engine import ProbabilityEngine
+from TOPR.graph import DIRECTIONS
+
+# commands of the control buffer
+RUN, STOP = 0, 1
+
+
+def split_at_nodes(compiled):
+    """
+    Return label of every trail element - elements of one piece of the trail between two nodes share
+    the label. Moves from and to node parts are cut, so every node part is a piece of its own.
+    """
+    labels = np.arange(len(compiled))
+    kept = ~compiled.part_of_node[compiled.sources] & ~compiled.part_of_node[compiled.targets]
+    sources = compiled.sources[kept]
+    targets = compiled.targets[kept]
+    while True:
+        # hook the larger label of every move to the smaller one, then jump labels to their roots
+        hooked = labels.copy()
+        np.minimum.at(hooked, labels[sources], labels[targets])
+        np.minimum.at(hooked, labels[targets], labels[sources])
+        while True:
+            jumped = hooked[hooked]
+            if np.array_equal(jumped, hooked):
+                break
+            hooked = jumped
+        if np.array_equal(hooked, labels):
+            return labels
+        labels = hooked
+
+
+def partition(compiled, parts):
+    """
+    Return partition of every trail element - pieces of split_at_nodes given to parts partitions,
+    the largest pieces first to the partition with the fewest elements.
+    """
+    labels = split_at_nodes(compiled)
+    pieces, inverse, sizes = np.unique(labels, return_inverse=True, return_counts=True)
+    loads = np.zeros(parts, dtype=np.int64)
+    assigned = np.zeros(pieces.size, dtype=np.int64)
+    for piece in np.argsort(-sizes, kind="stable"):
+        assigned[piece] = loads.argmin()
+        loads[assigned[piece]] += sizes[piece]
+    return assigned[inverse]
+
+
+def _worker(buffer_name, control_name, size, states, rows, cols, weights, prune_threshold, index, start, done,
+            step_barrier):
+    """
+    Step the states of one partition - rows, cols and weights are its moves, rows as indexes of states.
+    Reads probability of any state from the shared buffer, writes only its own.
+    """
+    buffer = shared_memory.SharedMemory(name=buffer_name)
+    control = shared_memory.SharedMemory(name=control_name)
+    try:
+        buffers = np.ndarray((2, size), dtype=np.float64, buffer=buffer.buf)
+        command = np.ndarray(3, dtype=np.int64, buffer=control.buf)
+        pruned_probability = np.ndarray(step_barrier.parties, dtype=np.float64, buffer=control.buf, offset=24)
+        while True:
+            start.wait()
+            if command[0] == STOP:
+                break
+            current = int(command[2])
+            pruned_probability[index] = 0.0
+            for _ in range(command[1]):
+                state = np.bincount(rows, weights=weights * buffers[current][cols], minlength=states.size)
+                if prune_threshold > 0:
+                    pruned = (state > 0) & (state < prune_threshold)
+                    pruned_probability[index] += state[pruned].sum()
+                    state[pruned] = 0.0
+                buffers[1 - current][states] = state
+                current = 1 - current
+                step_barrier.wait()
+            done.wait()
+    finally:
+        buffer.close()
+        control.close()
+
+
+def _stop_workers(buffer, control, start, workers):
+    """
+    Stop the workers of PartitionedEngine and free its shared memory - no arrays may be left on the buffers.
+    """
+    command = np.ndarray(3, dtype=np.int64, buffer=control.buf)
+    command[0] = STOP
+    del command
+    start.wait()
+    for process in workers:
+        process.join()
+    buffer.close()
+    buffer.unlink()
+    control.close()
+    control.unlink()
+
+
+class PartitionedEngine(ProbabilityEngine):
+    """
+    ProbabilityEngine stepping its trail in several processes.
+
+    The trail is split at the nodes and the pieces are spread over the workers (see partition). Probability is
+    kept twice in shared memory - the current and the next step - every worker computes the next probability
+    of its own elements from the current one, so the only probability it takes from the others is the one
+    on the moves crossing into its partition. The sums are done in the same order as ProbabilityEngine does,
+    so the results are the same to the last bit.
+    Workers keep running until close is called, or until the engine is garbage collected
+    (or the interpreter exits) without it.
+    """
+
+    def __init__(self, compiled, probability=None, prob_forward=0.9, prob_backward=0.05, prob_stay=0.05,
+                 prune_threshold=0.0, workers=default_workers, precision="float64"):
+        """
+        workers: Number of worker processes, all cores if None.
+        precision: Only "float64" - the shared buffers hold plain probability.
+        Other arguments are those of ProbabilityEngine.
+        """
+        if precision != "float64":
+            raise ValueError("PartitionedEngine keeps probability in float64 only, not %s" % precision)
+        self._buffer = None
+        super().__init__(compiled, probability, prob_forward, prob_backward, prob_stay, prune_threshold)
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        workers = max(1, min(workers, len(compiled)))
+        size = len(DIRECTIONS) * len(compiled)
+
+        self._buffer = shared_memory.SharedMemory(create=True, size=max(1, 2 * size * 8))
+        self._control = shared_memory.SharedMemory(create=True, size=24 + 8 * workers)
+        self._buffers = np.ndarray((2, size), dtype=np.float64, buffer=self._buffer.buf)
+        self._command = np.ndarray(3, dtype=np.int64, buffer=self._control.buf)
+        self._pruned = np.ndarray(workers, dtype=np.float64, buffer=self._control.buf, offset=24)
+        self._current = 0
+        self._buffers[0] = self._probability.ravel()
+        del self._probability
+
+        # barriers and processes from the same context, so the workers can open the barriers whatever
+        # the start method is
+        context = multiprocessing.get_context()
+        self._start = context.Barrier(workers + 1)
+        self._done = context.Barrier(workers + 1)
+        self._step_barrier = context.Barrier(workers)
+        owner = np.tile(partition(compiled, workers), len(DIRECTIONS))
+        self.partitions = owner[:len(compiled)]
+        self._workers = []
+        for index in range(workers):
+            states = np.flatnonzero(owner == index)
+            moves = owner[self._rows] == index
+            local = np.full(size, -1, dtype=np.intp)
+            local[states] = np.arange(states.size)
+            process = context.Process(
+                target=_worker, daemon=True,
+                args=(self._buffer.name, self._control.name, size, states, local[self._rows[moves]],
+                      self._cols[moves], self._weights[moves], prune_threshold, index, self._start, self._done,
+                      self._step_barrier))
+            process.start()
+            self._workers.append(process)
+        # frees the workers and shared memory of an engine dropped without close, e.g. by a server reset
+        self._finalizer = weakref.finalize(self, _stop_workers, self._buffer, self._control, self._start,
+                                           self._workers)
+
+    @property
+    def probability(self):
+        """
+        (direction, trail element) array of the current probability - a copy of the shared one.
+        """
+        if self._buffer is None:
+            return self._probability
+        return self._buffers[self._current].reshape(len(DIRECTIONS), -1).copy()
+
+    @probability.setter
+    def probability(self, probability):
+        if self._buffer is None:
+            self._probability = probability
+        else:
+            self._buffers[self._current] = np.asarray(probability).ravel()
+
+    def get_state(self):
+        return self.probability
+
+    def set_state(self, state):
+        self.probability = state
+
+    def run(self, steps):
+        """
+        Advance the probability by the given number of steps at once, without stopping after each of them.
+        maximum_probability and minimum_probability are those after the last step.
+        """
+        if steps <= 0:
+            return
+        self._command[:] = (RUN, steps, self._current)
+        self._start.wait()
+        self._done.wait()
+        self._current = (self._current + steps) % 2
+        self.pruned_probability = float(self._pruned.sum())
+        self.total_pruned_probability += self.pruned_probability
+        self._update_extremes()
+
+    def step(self):
+        """
+        Advance the probability of all tourists by one step.
+        """
+        self.run(1)
+
+    def get_cell_probabilities(self):
+        if self._buffer is None:
+            return self._probability.sum(axis=0)
+        return self._buffers[self._current].reshape(len(DIRECTIONS), -1).sum(axis=0)
+
+    def get_probability(self, position, direction=None):
+        if self._buffer is None:
+            return super().get_probability(position, direction)
+        i = self.index.get(position)
+        if i is None:
+            return 0.0
+        probability = self._buffers[self._current].reshape(len(DIRECTIONS), -1)
+        if direction is None:
+            return float(probability[:, i].sum())
+        return float(probability[DIRECTIONS.index(direction), i])
+
+    def close(self):
+        """
+        Stop the workers and free the shared memory.
+        """
+        if self._buffer is None:
+            return
+        self._probability = self.probability
+        del self._buffers, self._command, self._pruned
+        self._finalizer()
+        self._buffer = None
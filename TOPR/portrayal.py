@@ -1,6 +1,8 @@
 from TOPR.agents import Tourist, TrailElement
 import math
 
+import numpy as np
+
 
 def tourist_trial_portrayal(agent):
     if agent is None:
@@ -41,3 +43,23 @@ def floatRgb(mag, cmin, cmax):
     red = min((max((4 * (x - 0.25), 0.)), 1.))
     green = min((max((4 * math.fabs(x - 0.5) - 1., 0.)), 1.))
     return red, green, blue
+
+
+def probability_colors(probabilities, cmin, cmax):
+    """
+    floatRgb for a whole array of probabilities at once.
+    Return colours packed as 0xRRGGBB integers, 0 (black - bare trail) where probability is not positive.
+    """
+    probabilities = np.asarray(probabilities, dtype=float)
+    if cmax == cmin:
+        x = np.full(probabilities.shape, 0.5)
+    else:
+        x = (probabilities - cmin) / (cmax - cmin)
+    blue = np.clip(4 * (0.75 - x), 0., 1.)
+    red = np.clip(4 * (x - 0.25), 0., 1.)
+    green = np.clip(4 * np.fabs(x - 0.5) - 1., 0., 1.)
+
+    colors = ((red * 255).astype(np.int64) << 16) | ((green * 255).astype(np.int64) << 8) | \
+        (blue * 255).astype(np.int64)
+    colors[probabilities <= 0] = 0
+    return colors
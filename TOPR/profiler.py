@@ -0,0 +1,84 @@
+import time
+
+import numpy as np
+
+# counters recorded for every step, as differences of the totals kept by the model
+COUNTERS = ("tourists_created", "tourists_reused", "tourists_merged", "neighbour_queries")
+# agents stepped after every step - tourists and trail elements in the schedules of the model
+LIVE = ("live_tourists", "live_trail_elements")
+
+
+class StepProfiler:
+    """
+    Measures every phase of TOPRAction.step and counts the work done in it.
+
+    For every profiled step it records wall time of each phase of model.phases, wall time of the whole step,
+    tourists created, reused and merged by TouristPool, neighbour queries (TrailGraph.get_moves lookups)
+    and tourists and trail elements scheduled after the step - a trail element gets into the schedule
+    once tourists can reach it.
+    A model without profiler only checks that it has none, so nothing is measured then.
+    """
+
+    def __init__(self, model):
+        """
+        model: TOPRAction to profile, the profiler attaches itself to it.
+        """
+        self.model = model
+        self.phases = [name for name, _ in model.phases]
+        self.columns = ["step"] + self.phases + ["step_seconds"] + list(COUNTERS) + list(LIVE)
+        self._rows = []
+        model.profiler = self
+
+    def _counters(self, model):
+        pool = model.tourist_pool
+        return pool.created, pool.reused, pool.merged, model.trail.graph.queries
+
+    def profile(self, model):
+        """
+        Run phases of one step of model, measuring them - called by TOPRAction.step.
+        """
+        counters = self._counters(model)
+        row = [model.step_performed]
+        begin = time.perf_counter()
+        start = begin
+        for _, phase in model.phases:
+            phase()
+            end = time.perf_counter()
+            row.append(end - start)
+            start = end
+        row.append(start - begin)
+        row.extend(after - before for before, after in zip(counters, self._counters(model)))
+        row.append(model.schedule_tourists.get_agent_count())
+        row.append(model.schedule_trail_elements.get_agent_count())
+        self._rows.append(row)
+
+    def get_series(self):
+        """
+        Return {column: array with value of every profiled step} - step is the number of the step,
+        phases and step_seconds are in seconds.
+        """
+        rows = np.array(self._rows, dtype=float).reshape(-1, len(self.columns))
+        series = {column: rows[:, i] for i, column in enumerate(self.columns)}
+        for column in ["step"] + list(COUNTERS) + list(LIVE):
+            series[column] = series[column].astype(np.int64)
+        return series
+
+    def get_totals(self):
+        """
+        Return {column: sum over the profiled steps} of times and counters.
+        """
+        series = self.get_series()
+        return {column: series[column].sum().item() for column in self.phases + ["step_seconds"] + list(COUNTERS)}
+
+    def save(self, path):
+        """
+        Save the series as .npz file at path, one array per column.
+        """
+        np.savez(path, **self.get_series())
+
+    def close(self):
+        """
+        Detach from the model - it is not measured any more, recorded steps stay.
+        """
+        if self.model.profiler is self:
+            self.model.profiler = None
@@ -0,0 +1,71 @@
+import os
+
+import numpy as np
+
+from TOPR.graph import DIRECTIONS
+
+
+class ProbabilityRecorder:
+    """
+    Streams the probability of every trail element and direction to disk after each step of the model.
+
+    Recording is a directory with three .npy files, preallocated for the whole run:
+    probability.npy - (steps, direction, trail element) array written through np.memmap,
+    steps.npy - number of the step every row was recorded after, -1 for rows not written,
+    positions.npy - (x, y) of every trail element.
+    Only the step being written is held in memory.
+    """
+
+    def __init__(self, path, model, steps):
+        """
+        path: Directory the recording is written to.
+        model: TOPRAction to record, the recorder attaches itself to it.
+        steps: Number of steps to preallocate.
+        """
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.model = model
+        self.recorded = 0
+
+        compiled = model.trail.graph.compile()
+        np.save(os.path.join(path, "positions.npy"), np.asarray(compiled.positions))
+        self._probability = np.lib.format.open_memmap(os.path.join(path, "probability.npy"), mode="w+",
+                                                      dtype=np.float64,
+                                                      shape=(steps, len(DIRECTIONS), len(compiled)))
+        self._steps = np.lib.format.open_memmap(os.path.join(path, "steps.npy"), mode="w+", dtype=np.int64,
+                                                shape=(steps,))
+        self._steps[:] = -1
+
+        model.recorder = self
+
+    def record(self, model):
+        """
+        Write the current probability of model as the next row - called by TOPRAction.step.
+        """
+        if self.recorded >= len(self._steps):
+            raise IndexError("Recording in %s is full - %d steps preallocated" % (self.path, len(self._steps)))
+        self._probability[self.recorded] = model.get_probabilities()
+        self._steps[self.recorded] = model.step_performed - 1
+        self.recorded += 1
+
+    def close(self):
+        """
+        Flush the recording to disk and detach from the model.
+        """
+        self._probability.flush()
+        self._steps.flush()
+        if self.model.recorder is self:
+            self.model.recorder = None
+
+
+def load_recording(path):
+    """
+    Open a recording made by ProbabilityRecorder without reading it into memory.
+    Return (steps, probability, positions) - probability is a read only memmap of the recorded rows,
+    so any steps can be sliced from it.
+    """
+    steps = np.load(os.path.join(path, "steps.npy"), mmap_mode="r")
+    recorded = int(np.count_nonzero(steps >= 0))
+    probability = np.load(os.path.join(path, "probability.npy"), mmap_mode="r")
+    positions = np.load(os.path.join(path, "positions.npy"))
+    return steps[:recorded], probability[:recorded], positions
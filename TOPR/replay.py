@@ -0,0 +1,66 @@
+import numpy as np
+from mesa import Model
+
+from TOPR.recorder import load_recording
+
+
+class ReplayModel(Model):
+    """
+    Plays back a recording of ProbabilityRecorder in place of TOPRAction - a step only moves to another
+    recorded step and reads its row from the memory mapped recording, nothing is computed by any model.
+    Any number of replays can read the same recording.
+
+    frame: Index of the recorded row shown, step_performed is the model step after which it was recorded.
+    """
+
+    def __init__(self, path, start=0, speed=1):
+        """
+        path: Directory of the recording.
+        start: Step to start at, the first recorded step from it on (the last one if there is none).
+        speed: Recorded steps a step moves by - more than 1 fast forwards, negative rewinds, 0 stays.
+        """
+        super().__init__()
+        self.path = path
+        self.steps, self.probability, self.positions = load_recording(path)
+        if not len(self.steps):
+            raise ValueError("Recording in %s has no steps" % path)
+        self.speed = int(speed)
+        self.seek(int(np.searchsorted(self.steps, start)))
+
+    def seek(self, frame):
+        """
+        Show the recorded row frame, clipped to the recording.
+        """
+        last = len(self.steps) - 1
+        self.frame = min(max(frame, 0), last)
+        self.step_performed = int(self.steps[self.frame]) + 1
+        self._cells = np.asarray(self.probability[self.frame]).sum(axis=0)
+        occupied = self._cells[self._cells > 0]
+        self.maximum_probability = occupied.max() if occupied.size else 0
+        self.minimum_probability = occupied.min() if occupied.size else 1
+        # the server stops asking for steps at the end of the recording in the direction of the replay
+        self.running = (self.speed > 0 and self.frame < last) or (self.speed < 0 and self.frame > 0)
+
+    def step(self):
+        """
+        Move by speed recorded steps.
+        """
+        self.seek(self.frame + self.speed)
+
+    def get_positions(self):
+        """
+        Return (x, y) of every trail element, in the order of get_cell_probabilities.
+        """
+        return self.positions
+
+    def get_probabilities(self):
+        """
+        Return (direction, trail element) array of the recorded probability, as TOPRAction.get_probabilities.
+        """
+        return np.asarray(self.probability[self.frame])
+
+    def get_cell_probabilities(self):
+        """
+        Return probability of every trail element, summed over directions.
+        """
+        return self._cells
@@ -1,11 +1,33 @@
-from mesa.visualization.modules import CanvasGrid
 from mesa.visualization.ModularVisualization import ModularServer
+from mesa.visualization.UserParam import UserSettableParameter
 
-from TOPR.portrayal import tourist_trial_portrayal
+from TOPR.canvas import TrailCanvas
 from TOPR.model import TOPRAction
 from TOPR.config import width, height, canvas_width, canvas_height
+from TOPR.recorder import load_recording
+from TOPR.replay import ReplayModel
 
-canvas_element = CanvasGrid(tourist_trial_portrayal, grid_width=width, grid_height=height,
-                            canvas_width=canvas_width, canvas_height=canvas_height)
+canvas_element = TrailCanvas(grid_width=width, grid_height=height,
+                             canvas_width=canvas_width, canvas_height=canvas_height)
 
 server = ModularServer(TOPRAction, [canvas_element], "TOPRAction")
+
+
+def replay_server(path):
+    """
+    Return ModularServer playing back the recording in path with ReplayModel, without running the model.
+    Sliders choose the step to start at and the speed, negative to rewind - Reset jumps to the chosen step.
+    """
+    steps, _, positions = load_recording(path)
+    if not len(steps):
+        raise ValueError("Recording in %s has no steps" % path)
+    # the recorded trail may be larger than the default grid
+    replay_canvas = TrailCanvas(grid_width=max(width, int(positions[:, 0].max()) + 1),
+                                grid_height=max(height, int(positions[:, 1].max()) + 1),
+                                canvas_width=canvas_width, canvas_height=canvas_height)
+    model_params = {
+        "path": path,
+        "start": UserSettableParameter("slider", "Start at step", int(steps[0]), int(steps[0]), int(steps[-1]), 1),
+        "speed": UserSettableParameter("slider", "Steps per frame (negative rewinds)", 1, -20, 20, 1),
+    }
+    return ModularServer(ReplayModel, [replay_canvas], "TOPRAction replay", model_params)
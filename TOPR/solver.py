@@ -0,0 +1,135 @@
+import numpy as np
+
+from TOPR.engine import build_transitions
+from TOPR.graph import DIRECTIONS, FORWARD
+
+
+class MarkovSolver:
+    """
+    Solves the chain ProbabilityEngine steps through - (direction, trail element) states and the transition
+    matrix of the moves of the compiled trail - without stepping it.
+
+    Probability after step T is P^T applied to the initial probability. P^T is a product of the squares
+    P, P^2, P^4, ... for the bits of T, the squares are computed once and kept, so every later query
+    is only a few matrix-vector products. The matrix is dense - (3 x trail elements)^2 floats, 32 MB and
+    seconds for the first query on trail_for_three, 7 GB for 10^4 elements - so the solver is meant for trails
+    of up to a few thousand elements, larger ones are for ProbabilityEngine.
+    Moves into several neighbours ahead can create probability, so P^T may grow as well as vanish;
+    every square is kept scaled to 1 with its scale in log.
+    """
+
+    def __init__(self, compiled, probability=None, prob_forward=0.9, prob_backward=0.05, prob_stay=0.05):
+        """
+        compiled: CompiledTrail whose elements index the probability arrays.
+        probability: Initial (direction, trail element) array, by default one forward
+                     tourist in every trail start - like ProbabilityEngine.
+        """
+        self.compiled = compiled
+        self.shape = (len(DIRECTIONS), len(compiled))
+        if probability is None:
+            probability = np.zeros(self.shape)
+            probability[FORWARD, compiled.starts] = 1.0
+        self.probability = np.asarray(probability, dtype=float)
+        self.prob_forward = prob_forward
+        self.prob_backward = prob_backward
+        self.prob_stay = prob_stay
+
+        size = self.shape[0] * self.shape[1]
+        rows, cols, weights = build_transitions(compiled, prob_forward, prob_backward, prob_stay)
+        self.matrix = np.zeros((size, size))
+        np.add.at(self.matrix, (rows, cols), weights)
+        # (P^(2^k) / exp(log_scale), log_scale) for k = 0, 1, ...
+        self._squares = [(self.matrix, 0.0)]
+
+    @classmethod
+    def from_model(cls, model):
+        """
+        Create the solver for the trail of model, starting from its current probability - distribution(T)
+        is then the probability T steps after the current one.
+        """
+        return cls(model.trail.graph.compile(), model.get_probabilities(), model.prob_forward, model.prob_backward,
+                   model.prob_stay)
+
+    def _square(self, k):
+        while len(self._squares) <= k:
+            square, log_scale = self._squares[-1]
+            square = square @ square
+            scale = np.abs(square).max()
+            if scale > 0:
+                square /= scale
+            self._squares.append((square, 2 * log_scale + (np.log(scale) if scale > 0 else 0.0)))
+        return self._squares[k]
+
+    def distribution(self, steps):
+        """
+        Return (direction, trail element) probability after the given number of steps.
+        """
+        if steps < 0:
+            raise ValueError("Number of steps can not be negative: %s" % steps)
+        state = self.probability.ravel()
+        log_scale = 0.0
+        k = 0
+        while steps:
+            if steps & 1:
+                square, square_scale = self._square(k)
+                state = square @ state
+                log_scale += square_scale
+                norm = np.abs(state).max()
+                if norm == 0:
+                    return np.zeros(self.shape)
+                state = state / norm
+                log_scale += np.log(norm)
+            steps >>= 1
+            k += 1
+        return (state * np.exp(log_scale)).reshape(self.shape)
+
+    def cell_distribution(self, steps):
+        """
+        Return probability of every trail element after the given number of steps, summed over directions.
+        """
+        return self.distribution(steps).sum(axis=0)
+
+    def stationary_distribution(self, tolerance=1e-12, max_squarings=64):
+        """
+        Return (growth, distribution) - the shape the probability settles to and the factor it is multiplied
+        by every step once it is there, the dominant eigenvalue of the chain. distribution sums up to 1.
+        It is found by applying P^(2^k) for k = 0, 1, ... to the initial probability until it stops changing.
+        Raise ValueError if it does not settle in max_squarings squares (e.g. it oscillates).
+        """
+        state = self.probability.ravel() / self.probability.sum()
+        for k in range(max_squarings):
+            square, _ = self._square(k)
+            following = square @ state
+            total = following.sum()
+            if total == 0:
+                raise ValueError("All probability leaves the trail, there is no stationary distribution")
+            following /= total
+            if np.abs(following - state).max() < tolerance:
+                growth = (self.matrix @ following).sum()
+                return growth, following.reshape(self.shape)
+            state = following
+        raise ValueError("Probability did not settle in %d squarings" % max_squarings)
+
+    def absorption(self):
+        """
+        Return (elements, absorbed) - indexes of the trail elements probability leaves the trail from
+        and the total probability that leaves through each of them over the whole run.
+
+        A state loses what its moves do not carry on - 1 minus the sum of its column of the matrix: moves ahead
+        at a trail end, moves backward out of a trail start, backward and staying tourists at the root
+        of a node (they do not enter it) and forward probability of node parts that do not exist. Where moves
+        add up to more than 1 the loss is negative - probability is created there.
+        Raise ValueError if the probability of the chain does not vanish (dominant eigenvalue not below 1),
+        then the total is infinite.
+        """
+        radius = np.abs(np.linalg.eigvals(self.matrix)).max()
+        if radius >= 1:
+            raise ValueError("Probability does not vanish (dominant eigenvalue %s), absorption is infinite" % radius)
+
+        # probability ever present in every state - sum of P^t x over all t
+        size = self.matrix.shape[0]
+        visits = np.linalg.solve(np.eye(size) - self.matrix, self.probability.ravel())
+        outflow = ((1.0 - self.matrix.sum(axis=0)) * visits).reshape(self.shape).sum(axis=0)
+        # column sums of 1 leave rounding noise only
+        elements = np.flatnonzero(np.abs(outflow) > 1e-12 * max(np.abs(outflow).max(), 1e-300))
+        return elements, outflow[elements]
@@ -0,0 +1,149 @@
+from mesa.space import accept_tuple_argument
+
+
+class TrailGrid:
+    """
+    Grid of width x height cells that keeps only the cells holding any agent - cell contents in a dict
+    keyed by (x, y), so its memory grows with the trail, not with the area of the map.
+
+    It has the part of mesa MultiGrid the model uses - grid[x][y] contents, placing, moving and removing
+    agents, emptiness and Moore / von Neumann neighbourhoods. Empty cells are not stored anywhere,
+    so there is no list of empties and coord_iter goes over the occupied cells only.
+    Agents of a cell are kept in the order they were placed, as MultiGrid does, so runs repeat bit for bit.
+    """
+
+    def __init__(self, width, height, torus):
+        self.width = width
+        self.height = height
+        self.torus = torus
+        self._cells = {}
+
+    def __getitem__(self, x):
+        return _Column(self._cells, x)
+
+    def __iter__(self):
+        """
+        Iterate over contents of the occupied cells.
+        """
+        return iter(self._cells.values())
+
+    def __len__(self):
+        """
+        Number of occupied cells.
+        """
+        return len(self._cells)
+
+    def coord_iter(self):
+        """
+        Iterate over (contents, x, y) of the occupied cells.
+        """
+        for (x, y), contents in self._cells.items():
+            yield contents, x, y
+
+    def torus_adj(self, pos):
+        if not self.out_of_bounds(pos):
+            return pos
+        if not self.torus:
+            raise IndexError("Point out of bounds, and space non-toroidal.")
+        return pos[0] % self.width, pos[1] % self.height
+
+    def out_of_bounds(self, pos):
+        x, y = pos
+        return x < 0 or x >= self.width or y < 0 or y >= self.height
+
+    def iter_neighborhood(self, pos, moore, include_center=False, radius=1):
+        """
+        Iterate over coordinates of cells around pos - all 8 around with moore, 4 without,
+        up to radius cells away.
+        """
+        x, y = pos
+        seen = set()
+        for dx in range(-radius, radius + 1):
+            for dy in range(-radius, radius + 1):
+                if dx == 0 and dy == 0 and not include_center:
+                    continue
+                if not moore and abs(dx) + abs(dy) > radius:
+                    continue
+                cell = (x + dx, y + dy)
+                if self.out_of_bounds(cell):
+                    if not self.torus:
+                        continue
+                    cell = self.torus_adj(cell)
+                if cell not in seen:
+                    seen.add(cell)
+                    yield cell
+
+    def get_neighborhood(self, pos, moore, include_center=False, radius=1):
+        return list(self.iter_neighborhood(pos, moore, include_center, radius))
+
+    def iter_neighbors(self, pos, moore, include_center=False, radius=1):
+        """
+        Iterate over agents in the cells around pos - see iter_neighborhood.
+        """
+        return self.iter_cell_list_contents(self.iter_neighborhood(pos, moore, include_center, radius))
+
+    def get_neighbors(self, pos, moore, include_center=False, radius=1):
+        return list(self.iter_neighbors(pos, moore, include_center, radius))
+
+    @accept_tuple_argument
+    def iter_cell_list_contents(self, cell_list):
+        for cell in cell_list:
+            contents = self._cells.get(cell)
+            if contents:
+                yield from contents
+
+    @accept_tuple_argument
+    def get_cell_list_contents(self, cell_list):
+        return list(self.iter_cell_list_contents(cell_list))
+
+    def place_agent(self, agent, pos):
+        """
+        Put agent into the cell at pos.
+        """
+        if self.out_of_bounds(pos):
+            raise IndexError("Cell %s is outside of the %d x %d grid" % (pos, self.width, self.height))
+        self._place_agent(pos, agent)
+        agent.pos = pos
+
+    def _place_agent(self, pos, agent):
+        contents = self._cells.get(pos)
+        if contents is None:
+            # dict of agents - ordered like a list, removed from like a set
+            contents = self._cells[pos] = {}
+        contents[agent] = None
+
+    def remove_agent(self, agent):
+        self._remove_agent(agent.pos, agent)
+        agent.pos = None
+
+    def _remove_agent(self, pos, agent):
+        contents = self._cells[pos]
+        del contents[agent]
+        if not contents:
+            del self._cells[pos]
+
+    def move_agent(self, agent, pos):
+        pos = self.torus_adj(pos)
+        self._remove_agent(agent.pos, agent)
+        self.place_agent(agent, pos)
+
+    def is_cell_empty(self, pos):
+        return pos not in self._cells
+
+    def exists_empty_cells(self):
+        return len(self._cells) < self.width * self.height
+
+
+class _Column:
+    """
+    Column x of TrailGrid - grid[x][y] is contents of the cell, empty if nothing is there.
+    """
+
+    __slots__ = ("_cells", "_x")
+
+    def __init__(self, cells, x):
+        self._cells = cells
+        self._x = x
+
+    def __getitem__(self, y):
+        return self._cells.get((self._x, y), ())
@@ -0,0 +1,69 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+
+import numpy as np
+
+from TOPR.agents import TRAIL_LAYOUTS
+from TOPR.cache import ResultCache
+from TOPR.engine import ProbabilityEngine
+from TOPR.model import TOPRAction
+
+# compiled trails of the worker process, sent once by _init_worker instead of with every run
+_compiled_trails = {}
+
+
+def compile_layouts(layouts):
+    """
+    Build each layout once and return {layout: CompiledTrail}.
+    """
+    return {layout: TOPRAction(engine="vectorized", layout=layout).trail.graph.compile() for layout in layouts}
+
+
+def _init_worker(compiled_trails):
+    _compiled_trails.update(compiled_trails)
+
+
+def _run(layout, probabilities, steps, cache):
+    if cache is not None:
+        engine = ResultCache(cache).run(_compiled_trails[layout], steps, *probabilities)
+    else:
+        engine = ProbabilityEngine(_compiled_trails[layout], None, *probabilities)
+        for _ in range(steps):
+            engine.step()
+    return engine.get_cell_probabilities(), engine.maximum_probability, engine.minimum_probability
+
+
+def sweep(probabilities, layouts=TRAIL_LAYOUTS, steps=100, max_workers=None, cache=None):
+    """
+    Run the vectorized engine for every combination of probabilities and layouts on all cores.
+
+    probabilities: Iterable of (prob_forward, prob_backward, prob_stay) triples.
+    layouts: Trail layouts to run, each is built and compiled only once.
+    steps: How many steps every run takes.
+    max_workers: Number of worker processes, all cores by default.
+    cache: Directory of ResultCache to take the runs from and store them to, None to run all of them.
+
+    Return a table as dict of columns - layout, prob_forward, prob_backward, prob_stay,
+    maximum_probability, minimum_probability, total_probability and probability - per trail element
+    probability after the last step, in the order of the compiled trail of the layout.
+    """
+    compiled_trails = compile_layouts(layouts)
+    runs = list(product(layouts, [tuple(triple) for triple in probabilities]))
+
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                             initargs=(compiled_trails,)) as executor:
+        results = list(executor.map(_run, [layout for layout, _ in runs], [triple for _, triple in runs],
+                                    [steps] * len(runs), [cache] * len(runs)))
+
+    probability = np.empty(len(runs), dtype=object)
+    probability[:] = [cells for cells, _, _ in results]
+    return {
+        "layout": np.array([layout for layout, _ in runs]),
+        "prob_forward": np.array([triple[0] for _, triple in runs], dtype=float),
+        "prob_backward": np.array([triple[1] for _, triple in runs], dtype=float),
+        "prob_stay": np.array([triple[2] for _, triple in runs], dtype=float),
+        "maximum_probability": np.array([maximum for _, maximum, _ in results], dtype=float),
+        "minimum_probability": np.array([minimum for _, _, minimum in results], dtype=float),
+        "total_probability": np.array([cells.sum() for cells in probability], dtype=float),
+        "probability": probability,
+    }
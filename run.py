@@ -1,3 +1,13 @@
-from TOPR.server import server
+import argparse
 
-server.launch()
+parser = argparse.ArgumentParser(description="Serve the TOPRAction visualization.")
+parser.add_argument("--replay", help="directory of a recording (run_batch.py --record) to play back instead of "
+                                     "running the model")
+args = parser.parse_args()
+
+if args.replay:
+    from TOPR.server import replay_server
+    replay_server(args.replay).launch()
+else:
+    from TOPR.server import server
+    server.launch()
@@ -0,0 +1,3 @@
+from TOPR.batch import main
+
+main()
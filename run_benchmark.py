@@ -0,0 +1,4 @@
+from TOPR.benchmark import main
+
+if __name__ == "__main__":
+    main()
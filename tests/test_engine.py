@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+
+from TOPR.agents import TRAIL_LAYOUTS
+from TOPR.cache import ResultCache
+from TOPR.checkpoint import load_checkpoint, save_checkpoint
+from TOPR.engine import ProbabilityEngine
+from TOPR.model import ENGINES, TOPRAction
+
+STEPS = 120
+
+
+def run(engine, layout, steps=STEPS, **model_params):
+    """
+    Run TOPRAction with engine for steps, return probability of every trail element after each of them
+    and maximum_probability, minimum_probability of the last one.
+    """
+    model = TOPRAction(engine=engine, layout=layout, **model_params)
+    try:
+        cells = []
+        for _ in range(steps):
+            model.step()
+            cells.append(model.get_cell_probabilities())
+        return np.array(cells), model.maximum_probability, model.minimum_probability
+    finally:
+        model.close()
+
+
+@pytest.mark.parametrize("layout", TRAIL_LAYOUTS)
+@pytest.mark.parametrize("engine", [engine for engine in ENGINES if engine != "agents"])
+def test_engines_agree_with_agents(engine, layout):
+    expected, maximum, minimum = run("agents", layout)
+    cells, engine_maximum, engine_minimum = run(engine, layout, workers=2)
+    np.testing.assert_allclose(cells, expected, rtol=1e-12, atol=1e-15)
+    assert engine_maximum == pytest.approx(maximum, rel=1e-12)
+    assert engine_minimum == pytest.approx(minimum, rel=1e-12)
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_extremes_are_of_occupied_cells(engine):
+    model = TOPRAction(engine=engine, layout="trail_for_two")
+    try:
+        for _ in range(30):
+            model.step()
+        cells = model.get_cell_probabilities()
+        occupied = cells[cells > 0]
+        assert model.maximum_probability == pytest.approx(occupied.max(), rel=1e-12)
+        assert model.minimum_probability == pytest.approx(occupied.min(), rel=1e-12)
+    finally:
+        model.close()
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_checkpoint_continues_the_run(engine, tmp_path):
+    path = str(tmp_path / "checkpoint.npz")
+    model = TOPRAction(engine=engine, workers=2)
+    try:
+        for _ in range(20):
+            model.step()
+        save_checkpoint(model, path)
+        for _ in range(20):
+            model.step()
+        expected = model.get_cell_probabilities()
+    finally:
+        model.close()
+
+    restored = load_checkpoint(path)
+    try:
+        assert restored.engine_name == engine
+        for _ in range(20):
+            restored.step()
+        np.testing.assert_array_equal(restored.get_cell_probabilities(), expected)
+        assert restored.step_performed == model.step_performed
+    finally:
+        restored.close()
+
+
+def test_result_cache_resumes_from_snapshot(tmp_path):
+    compiled = TOPRAction(engine="vectorized").trail.graph.compile()
+    cache = ResultCache(str(tmp_path), interval=1000)
+    cache.run(compiled, 120)
+    assert cache.get_steps(compiled) == [120]
+
+    resumed = cache.run(compiled, 130)
+    assert cache.steps_run == 130
+    engine = ProbabilityEngine(compiled)
+    for _ in range(130):
+        engine.step()
+    np.testing.assert_array_equal(resumed.probability, engine.probability)
+    assert resumed.maximum_probability == engine.maximum_probability
+    assert resumed.minimum_probability == engine.minimum_probability
+
+
+@pytest.mark.parametrize("precision, steps, rtol", [("float32", 100, 5e-6), ("float32", 1000, 5e-5),
+                                                    ("log", 100, 1e-12), ("log", 1000, 1e-12)])
+def test_precision_agrees_with_float64(precision, steps, rtol):
+    compiled = TOPRAction(engine="vectorized").trail.graph.compile()
+    expected, engine = ProbabilityEngine(compiled), ProbabilityEngine(compiled, precision=precision)
+    for _ in range(steps):
+        expected.step()
+        engine.step()
+    # below the smallest normal number of the kept type digits are lost, ProbabilityEngine promises nothing there
+    tiny = np.finfo(np.float32 if precision == "float32" else np.float64).tiny
+    compared = expected.probability >= tiny
+    np.testing.assert_allclose(engine.probability[compared], expected.probability[compared], rtol=rtol, atol=0)